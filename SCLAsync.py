@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLAsync.py
+# Package       : rpmlint
+# Purpose       : Software Collections checks overlapping reads with checks.
+#############################################################################
+
+'''Run SCLCheck on many RPMs and spec files, reading ahead while checking
+
+Usage: python3 SCLAsync.py [-r readers] [-j checkers] [-p prefetch] path...
+Paths are found the same way as by SCLBatch. Reading a package (the RPM
+header and the spec files from the payload of source RPMs, or a spec file)
+is done by a pool of readers threads, 8 by default, while the packages
+already read are checked by a pool of checkers threads, 1 by default. At
+most prefetch packages, 16 by default, are being read, checked or waiting
+to be printed at once: when the output falls behind, reading stops. This
+pays off when the packages are on slow storage, such as NFS. Diagnostics
+are printed in the order of the (sorted) input, followed by a summary.
+Spec files are read ahead up to spec_prefetch_size bytes, the rest of a
+bigger one is read while it is checked. Spec files in source RPMs are
+read ahead whole, as check_source() does.
+
+Needs Python 3.6 or newer, unlike the rest of SCLCheck.'''
+
+import asyncio, collections, getopt, sys, tempfile, time
+from concurrent.futures import ThreadPoolExecutor
+
+import Config
+import Pkg
+import SCLBatch
+import SCLCheck
+
+# What check() needs of a package: specs is a list of (name, raw lines) to
+# check, or None when the package is checked by SCLCheck.check()
+Prefetched = collections.namedtuple('Prefetched', 'path pkg specs')
+
+# Bytes of a spec file read ahead, at most prefetch times this is held in memory
+spec_prefetch_size = 1024 * 1024
+
+def spec_lines(head, fobj):
+    '''Yield raw lines of a spec file, head was read ahead, the rest is read from fobj'''
+    try:
+        cut = head.rfind(b'\n') + 1
+        for line in SCLCheck.split_spec_lines(head[:cut], raw=True):
+            yield line
+        rest = head[cut:]
+        for line in fobj:
+            if rest:
+                line, rest = rest + line, b''
+            yield line
+        if rest:
+            yield rest
+    finally:
+        fobj.close()
+
+def read(path):
+    '''Return Prefetched package, done by the reader threads'''
+    if path.endswith('.spec'):
+        fobj = open(path, 'rb')
+        head = fobj.read(spec_prefetch_size)
+        if len(head) < spec_prefetch_size:
+            fobj.close()
+            lines = SCLCheck.split_spec_lines(head, raw=True)
+        else:
+            lines = spec_lines(head, fobj)
+        return Prefetched(path, Pkg.FakePkg(path), [(path, lines)])
+    pkg = Pkg.Pkg(path, Config.getOption('ExtractDir', tempfile.gettempdir()))
+    specs = None
+    if pkg.isSource():
+        specs = SCLCheck.spec_payloads(pkg)
+        if specs is not None:
+            specs = [(fname, SCLCheck.split_spec_lines(data, raw=True)) for fname, data in specs]
+    return Prefetched(path, pkg, specs)
+
+def check(prefetched):
+    '''Return Diagnostics of a Prefetched package, done by the checker threads'''
+    pkg = prefetched.pkg
+    try:
+        with SCLCheck.Diagnostics(pkg) as diags:
+            if prefetched.specs is None:
+                SCLCheck.check.check(pkg)
+            else:
+                for fname, lines in prefetched.specs:
+                    SCLCheck.check.check_spec(pkg, fname, lines)
+        return diags
+    finally:
+        if hasattr(pkg, 'cleanup'):
+            pkg.cleanup()
+
+def _timed(function, arg):
+    '''Return (function(arg), seconds it took), not counting the time waiting for a thread'''
+    start = time.time()
+    return function(arg), time.time() - start
+
+async def _process(loop, path, read, readers, check, checkers):
+    '''Return (path, Diagnostics or error message, seconds of reading, seconds of checking)'''
+    read_time = check_time = 0.0
+    try:
+        prefetched, read_time = await loop.run_in_executor(readers, _timed, read, path)
+        result, check_time = await loop.run_in_executor(checkers, _timed, check, prefetched)
+    except Exception as e:
+        result = '%s' % e
+    return path, result, read_time, check_time
+
+async def pipeline(paths, readers=8, checkers=1, prefetch=16, read=read, check=check):
+    '''Asynchronously yield (path, Diagnostics or error message, seconds of reading,
+    seconds of checking) of every path, in the order of paths
+
+    read(path) and check(result of read) are run in pools of readers and
+    checkers threads. Nothing new is read while prefetch paths are waiting
+    to be yielded, so a slow consumer holds the readers back.'''
+    loop = asyncio.get_event_loop()
+    paths = iter(paths)
+    pending = collections.deque()
+    with ThreadPoolExecutor(readers) as read_pool, ThreadPoolExecutor(checkers) as check_pool:
+        try:
+            while True:
+                for path in paths:
+                    pending.append(loop.create_task(_process(loop, path, read, read_pool, check, check_pool)))
+                    if len(pending) >= prefetch:
+                        break
+                if not pending:
+                    return
+                yield await pending.popleft()
+        finally:
+            # when the consumer gives up, the rest is thrown away: packages
+            # read already are not checked, reads running in the threads
+            # can't be stopped, the pools wait for them
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+async def _run(paths, readers, checkers, prefetch, out):
+    start = time.time()
+    errors = warnings = failed = 0
+    reading = checking = 0.0
+    async for path, diags, read_time, check_time in pipeline(paths, readers, checkers, prefetch):
+        reading += read_time
+        checking += check_time
+        if isinstance(diags, SCLCheck.Diagnostics):
+            diags.replay()
+            errors += diags.count('E')
+            warnings += diags.count('W')
+        else:
+            failed += 1
+            sys.stderr.write('(none): E: error while reading %s: %s\n' % (path, diags))
+    elapsed = time.time() - start
+    out.write('%d packages checked in %.2f s (%.1f packages/s, %.2f s of reads, %.2f s of checks), %d errors, %d warnings, %d failed.\n' %
+              (len(paths), elapsed, len(paths) / max(elapsed, 1e-6), reading, checking, errors, warnings, failed))
+    return errors + failed
+
+def run(paths, readers=8, checkers=1, prefetch=16, out=sys.stderr):
+    '''Check given paths in the pipeline, replay diagnostics in input order
+
+    Return the number of errors found. A summary is written to out.'''
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(_run(SCLBatch.find_packages(paths), readers, checkers, prefetch, out))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def main(argv):
+    readers = 8
+    checkers = 1
+    prefetch = 16
+    try:
+        opts, args = getopt.getopt(argv, 'r:j:p:h', ['readers=', 'jobs=', 'prefetch=', 'help'])
+        for o, a in opts:
+            if o in ('-r', '--readers'):
+                readers = int(a)
+            elif o in ('-j', '--jobs'):
+                checkers = int(a)
+            elif o in ('-p', '--prefetch'):
+                prefetch = int(a)
+            else:
+                sys.stdout.write(__doc__ + '\n')
+                return 0
+        if min(readers, checkers, prefetch) < 1:
+            raise ValueError('readers, checkers and prefetch have to be at least 1')
+    except (getopt.GetoptError, ValueError) as e:
+        sys.stderr.write('%s\n%s\n' % (e, __doc__))
+        return 2
+    if not args:
+        sys.stderr.write(__doc__ + '\n')
+        return 2
+    return 64 if run(args, readers, checkers, prefetch) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
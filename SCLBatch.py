@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLBatch.py
+# Package       : rpmlint
+# Purpose       : Software Collections checks of whole repositories.
+#############################################################################
+
+'''Run SCLCheck on many RPMs and spec files at once
+
+Usage: python SCLBatch.py [-j jobs] [-c chunk] [-t] [-C cache [-s MiB]] [-x] path...
+Every path is either a RPM, a spec file or a directory searched for them.
+Packages are checked in a pool of processes (or threads with -t, which is
+enough when most of the time is spent extracting the RPMs), diagnostics are
+printed in the order of the (sorted) input, followed by a throughput summary.
+With -C, results are cached in given file (of at most -s MiB, 64 by default)
+and unchanged packages are not checked again.
+With -x, the packages are also checked as a whole collection: every package
+of it has to require the runtime package, directly or through other ones.
+Set SCLCHECK_STATS to a file name to get timings and counters of the checks
+(in Prometheus text format if it ends with .prom, JSON otherwise), and
+SCLCHECK_DIAGNOSTICS to get the diagnostics in a machine readable file as
+well (JSON Lines if it ends with .jsonl, see SCLSink).'''
+
+import functools, getopt, multiprocessing, os, sys, tempfile, time
+from multiprocessing.pool import ThreadPool
+
+import Config
+import Pkg
+import SCLCache
+import SCLCheck
+import SCLIndex
+import SCLStats
+
+# SCLCache used by lint() in this process, see init_cache()
+_cache = None
+
+def init_cache(path, max_size):
+    '''Open the result cache used by lint(), run in every worker'''
+    global _cache
+    _cache = path and SCLCache.SCLCache(path, max_size)
+
+def init_worker(path, max_size, stats):
+    '''Run in every pool process: open the result cache and start recording
+    Stats if the main process does, they are sent back by lint()
+
+    Needed where the workers are not forked (the spawn and forkserver start
+    methods), as they don't inherit anything from the main process then.'''
+    init_cache(path, max_size)
+    if stats:
+        SCLCheck.enable_stats()
+
+def find_packages(paths):
+    '''Return RPMs and spec files in given paths, directories are searched recursively'''
+    res = []
+    for path in paths:
+        if not os.path.isdir(path):
+            res.append(path)
+            continue
+        found = []
+        for root, dirs, files in os.walk(path):
+            for fname in files:
+                if fname.endswith('.rpm') or fname.endswith('.spec'):
+                    found.append(os.path.join(root, fname))
+        res.extend(sorted(found))
+    return res
+
+def _checked(pkg, key, check):
+    '''Return Diagnostics of check(pkg), or cached ones, and whether they were cached'''
+    if _cache:
+        diags = _cache.get(key, pkg)
+        if diags is not None:
+            return diags, True
+    with SCLCheck.Diagnostics(pkg) as diags:
+        check(pkg)
+    if _cache:
+        _cache.put(key, diags)
+    return diags, False
+
+def lint(path, cross=False):
+    '''Check one RPM or spec file
+
+    Return (path, Diagnostics or error message, seconds, True if cached,
+    SCLIndex entries as (origin, entries) with cross, None otherwise)'''
+    start = time.time()
+    entries = None
+    try:
+        if path.endswith('.spec'):
+            pkg = Pkg.FakePkg(path)
+            key = _cache and SCLCache.spec_key(path)
+            models = []
+            diags, cached = _checked(pkg, key, lambda pkg: models.append(SCLCheck.check.check_spec(pkg, path)))
+            if cross:
+                # the spec is only parsed again when the diagnostics were cached
+                model = models[0] if models else SCLCheck.SpecModel(SCLCheck.read_spec_lines(path, raw=True))
+                entries = path, SCLIndex.spec_entries(model)
+        else:
+            pkg = Pkg.Pkg(path, Config.getOption('ExtractDir', tempfile.gettempdir()))
+            try:
+                # reading the key needs just the header, the package is extracted only on a miss
+                key = _cache and SCLCache.rpm_key(pkg)
+                diags, cached = _checked(pkg, key, SCLCheck.check.check)
+                if cross:
+                    entries = SCLIndex.package_entries(pkg)
+            finally:
+                pkg.cleanup()
+    except Exception as e:
+        return path, '%s' % e, time.time() - start, False, None
+    if SCLStats.stats is not None:
+        # sent along with the diagnostics when run in other process
+        diags.stats = SCLStats.stats.pop(diags.name)
+    return path, diags, time.time() - start, cached, entries
+
+def run(paths, jobs=None, chunksize=1, out=sys.stderr, threads=False, cache=None, cache_size=64*1024*1024, cross=False):
+    '''Check given paths in a pool of jobs processes (or threads), replay diagnostics in input order
+
+    With cross, collection-wide checks of SCLIndex follow, see the module docstring.
+    Return the number of errors found. A summary is written to out.'''
+    packages = find_packages(paths)
+    start = time.time()
+    errors = warnings = failed = hits = 0
+    busy = 0.0
+    # also creates the table before the workers race for it
+    init_cache(cache, cache_size)
+    if threads:
+        pool = ThreadPool(jobs)
+    else:
+        pool = multiprocessing.Pool(jobs, init_worker, (cache, cache_size, SCLStats.stats is not None))
+    # phase one of the cross checks is done along with the checks, see lint()
+    index = cross and SCLIndex.DependencyIndex()
+    try:
+        for path, diags, seconds, cached, entries in pool.imap(functools.partial(lint, cross=cross), packages, chunksize):
+            busy += seconds
+            hits += cached
+            if isinstance(diags, SCLCheck.Diagnostics):
+                diags.replay()
+                if diags.stats is not None and SCLStats.stats is not None:
+                    SCLStats.stats.merge(diags.name, diags.stats)
+                errors += diags.count('E')
+                warnings += diags.count('W')
+                if entries:
+                    index.add(*entries)
+            else:
+                failed += 1
+                sys.stderr.write('(none): E: error while reading %s: %s\n' % (path, diags))
+        if cross:
+            index.finish()
+            for origin, name in index.problems():
+                SCLCheck.printError(Pkg.FakePkg(origin), 'doesnt-reach-scl-runtime', name)
+                errors += 1
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+    out.write('%d packages checked in %.2f s (%.1f packages/s, %.2f s of checks), %d errors, %d warnings, %d failed.\n' %
+              (len(packages), elapsed, len(packages) / max(elapsed, 1e-6), busy, errors, warnings, failed))
+    if SCLStats.stats is not None:
+        out.write('Slowest: %s.\n' % ', '.join('%s (%.3f s)' % item for item in SCLStats.stats.slowest(5)))
+    if cache:
+        stats = _cache.stats()
+        out.write('Cache: %d hits, %d misses, %d entries (%d bytes).\n' %
+                  (hits, len(packages) - failed - hits, stats['entries'], stats['size']))
+    return errors + failed
+
+def main(argv):
+    jobs = None
+    chunksize = 1
+    threads = False
+    cache = None
+    cache_size = 64
+    cross = False
+    try:
+        opts, args = getopt.getopt(argv, 'j:c:tC:s:xh', ['jobs=', 'chunk=', 'threads', 'cache=', 'cache-size=', 'cross', 'help'])
+        for o, a in opts:
+            if o in ('-j', '--jobs'):
+                jobs = int(a)
+            elif o in ('-c', '--chunk'):
+                chunksize = int(a)
+            elif o in ('-t', '--threads'):
+                threads = True
+            elif o in ('-C', '--cache'):
+                cache = a
+            elif o in ('-s', '--cache-size'):
+                cache_size = int(a)
+            elif o in ('-x', '--cross'):
+                cross = True
+            else:
+                sys.stdout.write(__doc__ + '\n')
+                return 0
+    except (getopt.GetoptError, ValueError) as e:
+        sys.stderr.write('%s\n%s\n' % (e, __doc__))
+        return 2
+    if not args:
+        sys.stderr.write(__doc__ + '\n')
+        return 2
+    return 64 if run(args, jobs, chunksize, threads=threads, cache=cache, cache_size=cache_size*1024*1024, cross=cross) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLCache.py
+# Package       : rpmlint
+# Purpose       : Persistent cache of Software Collections checks results.
+#############################################################################
+
+'''Persistent cache of SCLCheck diagnostics keyed by package content
+
+Spec files are identified by the hash of their content, RPMs by the SHA1 of
+their header and their MD5 signature, so a cached RPM is never extracted.
+Every key also includes a fingerprint of SCLCheck itself and of the
+configuration options it reads, so changed checks never replay stale results.
+Entries are evicted in least recently used order once the total size of the
+stored diagnostics exceeds the limit.'''
+
+import binascii, hashlib, json, os, sqlite3, threading, time
+
+import rpm
+import Config
+import SCLCheck
+
+def fingerprint():
+    '''Return the hash of SCLCheck code and of the configuration options it reads'''
+    source = SCLCheck.__file__
+    if source.endswith('.pyc') or source.endswith('.pyo'):
+        source = source[:-1]
+    digest = hashlib.sha1()
+    with open(source, 'rb') as f:
+        digest.update(f.read())
+    for option in SCLCheck.config_options:
+        digest.update(repr((option, Config.getOption(option, None))).encode('utf-8'))
+    return digest.hexdigest()
+
+def spec_key(spec_file):
+    '''Return the content key of a spec file'''
+    with open(spec_file, 'rb') as f:
+        return 'spec:' + hashlib.sha1(f.read()).hexdigest()
+
+def rpm_key(pkg):
+    '''Return the content key of a RPM package from its header only, None if it has no digests'''
+    sha1 = pkg.header[rpm.RPMTAG_SHA1HEADER]
+    md5 = pkg.header[rpm.RPMTAG_SIGMD5]
+    if not sha1 and not md5:
+        return None
+    if md5:
+        md5 = binascii.hexlify(md5)
+    return 'rpm:%s:%s' % (SCLCheck.header_text(sha1 or ''), SCLCheck.header_text(md5 or ''))
+
+
+class SCLCache(object):
+    '''On disk, size bounded LRU cache of SCLCheck diagnostics
+
+    Can be shared by threads (each one gets its own connection) and processes
+    (sqlite does the locking).'''
+
+    def __init__(self, path, max_size=64*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        self.fingerprint = fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # of hits and misses
+        self._local = threading.local()
+        db = self._db()
+        db.execute('CREATE TABLE IF NOT EXISTS results '
+                   '(key TEXT PRIMARY KEY, records TEXT, size INTEGER, used REAL)')
+        db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        # running total of sizes, so put() doesn't have to sum the whole table
+        db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+        db.execute("INSERT OR IGNORE INTO meta SELECT 'size', COALESCE(SUM(size), 0) FROM results")
+        db.commit()
+
+    def _db(self):
+        '''Return sqlite connection of the current thread and process'''
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.db = sqlite3.connect(self.path, timeout=60)
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _key(self, content_key):
+        return hashlib.sha1((self.fingerprint + content_key).encode('utf-8')).hexdigest()
+
+    def get(self, content_key, pkg):
+        '''Return cached Diagnostics for given content key and package or None'''
+        if content_key is None:
+            self._count(False)
+            return None
+        key = self._key(content_key)
+        db = self._db()
+        row = db.execute('SELECT records FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count(False)
+            return None
+        db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        db.commit()
+        self._count(True)
+        diags = SCLCheck.Diagnostics(pkg)
+        for kind, reason, details, location in json.loads(row[0]):
+            diags.records.append((kind, reason, tuple(details)))
+            diags.locations.append(location and SCLCheck.Location(*location))
+        return diags
+
+    def put(self, content_key, diags):
+        '''Store Diagnostics for given content key and evict the least recently used entries'''
+        if content_key is None:
+            return
+        locations = diags.locations or [None] * len(diags.records)
+        records = json.dumps([list(r) + [l] for r, l in zip(diags.records, locations)])
+        key = self._key(content_key)
+        db = self._db()
+        # the first statement starts the transaction and locks the database
+        # for writing, so other processes can't change the total meanwhile
+        db.execute("UPDATE meta SET value = value - COALESCE((SELECT size FROM results WHERE key = ?), 0) "
+                   "WHERE name = 'size'", (key,))
+        db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                   (key, records, len(records), time.time()))
+        db.execute("UPDATE meta SET value = value + ? WHERE name = 'size'", (len(records),))
+        total = db.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+        while total > self.max_size:
+            oldest = db.execute('SELECT key, size FROM results ORDER BY used LIMIT 64').fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= self.max_size:
+                    break
+                db.execute('DELETE FROM results WHERE key = ?', (key,))
+                total -= size
+        db.execute("UPDATE meta SET value = ? WHERE name = 'size'", (total,))
+        db.commit()
+
+    def stats(self):
+        '''Return dictionary with hits and misses of this object and number and size of entries'''
+        db = self._db()
+        entries = db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        size = db.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size': size}
@@ -7,230 +7,1257 @@
 # Purpose       : Software Collections checks.
 #############################################################################
 
-import rpm, re, os
+import rpm, re, os, array, bisect, threading, collections, itertools
 
-from Filter import addDetails, printError, printWarning
-from TagsCheck import VALID_GROUPS
+from Filter import addDetails
+import Filter
 import AbstractCheck
 import Config
-import Pkg
-import Common
-
-# Compile all regexes here
-allowed_etc = re.compile(r'^/etc/(cron|profile|logrotate)\.d/', re.M)
-allowed_var = re.compile(r'^/var/(log|lock)/', re.M)
-buildrequires = re.compile(r'^BuildRequires:\s*(.*)', re.M)
-global_scl_definition = re.compile(r'(^|\s)%(define|global)\s+scl\s+\S+\s*$',re.M)
-libdir = re.compile(r'%\{?\??_libdir\}?', re.M)
-name = re.compile(r'^Name:\s*(.*)', re.M)
-name_small = re.compile(r'^%\{?name\}?', re.M)
-noarch = re.compile(r'^BuildArch:\s*noarch\s*$', re.M)
-obsoletes_conflicts = re.compile(r'^(Obsoletes|(Build)?Conflicts):\s*(.*)', re.M)
-pkg_name = re.compile(r'(^|\s)%\{!\?scl:%(define|global)\s+pkg_name\s+%\{name\}\}\s*$', re.M)
-provides = re.compile(r'^Provides:\s*(.*)', re.M)
-requires = re.compile(r'(^|:)Requires:\s*(.*)', re.M)
-scl_files = re.compile(r'(^|\s)%\{?\??scl_files\}?\s*$', re.M)
-scl_install = re.compile(r'(^|\s)%\{?\??scl_install\}?\s*$', re.M)
-scl_macros = re.compile(r'(^|\s)%\{?\??_root_sysconfdir\}?/rpm/macros\.%\{?\??scl\}?-config\s*^', re.M)
-scl_package_definition = re.compile(r'(^|\s)%\{\?scl\s*:\s*%scl_package\s+\S+\s*\}\s*$',re.M)
-scl_prefix_noncond = re.compile(r'%\{?scl_prefix\}?', re.M)
-scl_prefix = re.compile(r'%\{?\??scl_prefix\}?', re.M)
-scl_prefix_start = re.compile(r'^%\{?\??scl_prefix\}?', re.M)
-scl_runtime = re.compile(r'%\{?\??scl\}?-runtime\}?', re.M)
-scl_use = re.compile(r'%\{?\??\!?\??scl')
-setup = re.compile(r'^%setup(.*)', re.M)
-startdir = re.compile(r'^/opt/[^/]+/',re.M)
-subpackage_alien = re.compile(r'(^|\s)%package\s+(-n\s+)?(?!(build|runtime))\S+\s*$',re.M)
-subpackage_any = re.compile(r'(^|\s)%package\s+(.*)',re.M)
-subpackage_build = re.compile(r'(^|\s)%package\s+build\s*$',re.M)
-subpackage_runtime = re.compile(r'(^|\s)%package\s+runtime\s*$',re.M)
-
-
-def index_or_sub(source, word, sub=0):
-    '''Helper function that returns index of word in source or sub when not found'''
+import SCLStats
+from SCLStats import instrumented
+
+class LazyRegex(object):
+    '''Regex compiled on first use, when it replaces itself in module globals
+
+    Most regexes are never used for a given package type, so they are not
+    compiled at import time, which is a big part of the startup of one check.'''
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def compile(self):
+        '''Compile the regex and put it in place of this object, return it'''
+        regex = re.compile(self.pattern, self.flags)
+        for key, value in list(globals().items()):
+            if value is self:
+                globals()[key] = regex
+        return regex
+
+    def __getattr__(self, attr):
+        return getattr(self.compile(), attr)
+
+# All regexes are here, compiled on first use
+buildrequires = LazyRegex(r'^BuildRequires:\s*(.*)', re.M)
+name = LazyRegex(r'^Name:\s*(.*)', re.M)
+obsoletes_conflicts = LazyRegex(r'^(Obsoletes|(Build)?Conflicts):\s*(.*)', re.M)
+provides = LazyRegex(r'^Provides:\s*(.*)', re.M)
+requires = LazyRegex(r'(^|:)Requires:\s*(.*)', re.M)
+scl_files = LazyRegex(r'(^|\s)%\{?\??scl_files\}?\s*$', re.M)
+scl_macros = LazyRegex(r'(^|\s)%\{?\??_root_sysconfdir\}?/rpm/macros\.%\{?\??scl\}?-config\s*$', re.M)
+scl_prefix = LazyRegex(r'%\{?\??scl_prefix\}?', re.M)
+scl_prefix_start = LazyRegex(r'^%\{?\??scl_prefix\}?', re.M)
+scl_cond_if = LazyRegex(r'%\{(!?)\?scl[:}]')
+scl_cond_token = LazyRegex(r'%\{(!?)\?scl:|[{}]|^[ \t]*%(if\w*|elif\w*|else|endif)\b(.*)$', re.M)
+# %{name}, %{?scl_prefix} or %{scl}-runtime at the start of a one line value
+scl_require = LazyRegex(r'%\{?(?:name|\??scl_prefix|\??scl\}?-runtime)')
+spec_call = LazyRegex(r'^%\{?[?!]*(\w+)\}?(\s+.*)?$')
+spec_definition = LazyRegex(r'^%(define|global)\s+(\w+)(\([^)]*\))?\s+(.*)$')
+spec_macro = LazyRegex(r'%(\{)?([?!]*)(\w+)')
+spec_section_names = (r'package|description|prep|build|install|check|clean|files|changelog|'
+                      r'pretrans|pre|post|preun|postun|posttrans|verifyscript|'
+                      r'triggerprein|triggerin|triggerun|triggerpostun')
+spec_section = LazyRegex(r'^%(' + spec_section_names + r')(\s+.*)?$')
+spec_tag = LazyRegex(r'^([A-Za-z]\w*)(\([^)]*\))?:\s*(.*)$')
+# A stripped spec line starting with %, in one match: a section header, a one
+# line %{?foo:...} block, a macro definition or a line calling a macro, tried
+# in this order, the same way as spec_section, spec_definition and spec_call
+spec_directive = LazyRegex(r'''^%(?:
+    (?P<section>''' + spec_section_names + r''')(?P<section_args>\s+.*)?$
+  | \{(?P<condition>!?\?\w+):(?P<inner>.*)\}$
+  | (?:define|global)\s+(?P<definition>\w+)(?:\([^)]*\))?\s+(?P<value>.*)$
+  | \{?[?!]*(?P<call>\w+)\}?(?P<call_args>\s+.*)?$
+)''', re.X)
+
+# Where files of SCL packages belong, extended by SCLPathPolicy config option
+# Paths ending with / cover the whole tree below them, others just one file,
+# * matches any path component and %{scl} the name of the collection.
+# scl: the collection tree, bad: tree of another collection, allowed: fine,
+# macros: fine in -build subpackage, runtime: fine in -runtime subpackage
+default_path_policy = [
+    ('/opt/*/', 'bad'),
+    ('/opt/*/%{scl}', 'scl'),
+    ('/opt/*/%{scl}/', 'scl'),
+    ('/etc/cron.d/', 'allowed'),
+    ('/etc/profile.d/', 'allowed'),
+    ('/etc/logrotate.d/', 'allowed'),
+    ('/var/log/', 'allowed'),
+    ('/var/lock/', 'allowed'),
+    ('/usr/bin/', 'allowed'),
+    ('/etc/rpm/', 'macros'),
+    ('/etc/scl/prefixes/%{scl}', 'runtime'),
+]
+
+# Macros defined by scl-utils-build for SCL builds, see MacroExpander
+scl_utils_macros = [
+    ('scl_name', '%{scl}'),
+    ('scl_prefix', '%{scl}-'),
+    ('scl_runtime', '%{scl}-runtime'),
+    ('scl_basedir', '/opt'),
+    ('scl_vendor', 'rh'),
+    ('_scl_prefix', '%{scl_basedir}/%{scl_vendor}'),
+    ('_scl_scripts', '%{_scl_prefix}/%{scl}'),
+    ('_scl_root', '%{_scl_prefix}/%{scl}/root'),
+]
+
+# Config options read by the checks, results cached by SCLCache depend on them
+config_options = ('SCLPathPolicy',)
+
+# DiagnosticSink all diagnostics are written to, see enable_sink()
+sink = None
+
+
+def iter_tag_spans(text, regex, group, start=0, end=None):
+    '''Yield (start, end) spans of given group of all regex matches in text[start:end]
+    The text is never sliced, all spans point to the one shared buffer'''
+    if end is None: end = len(text)
+    for match in regex.finditer(text, start, end):
+        yield match.span(group)
+
+def iter_requires(text, start=0, end=None, build=False):
+    '''Yield spans of Requires (or BuildRequires) values in text[start:end]'''
+    if build:
+        return iter_tag_spans(text, buildrequires, 1, start, end)
+    return iter_tag_spans(text, requires, 2, start, end)
+
+def iter_provides(text, start=0, end=None):
+    '''Yield spans of Provides values in text[start:end]'''
+    return iter_tag_spans(text, provides, 1, start, end)
+
+def iter_obsoletes_and_conflicts(text, start=0, end=None):
+    '''Yield spans of Obsoletes, Conflicts and BuildConflicts values in text[start:end]'''
+    return iter_tag_spans(text, obsoletes_conflicts, 3, start, end)
+
+def span_values(text, spans):
+    '''Return the strings for given spans of text'''
+    return [text[start:end] for start, end in spans]
+
+
+def merge_spans(spans):
+    '''Return sorted union of given (start, end) spans'''
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def spec_payloads(pkg):
+    '''Return [(name, content)] of spec files of a source RPM, read from the payload
+
+    Return None if they can't be read without extracting the package.'''
+    if not getattr(pkg, 'filename', None):
+        return None
+    compressor = header_text(pkg.header[rpm.RPMTAG_PAYLOADCOMPRESSOR])
+    specs = [header_text(f) for f in pkg.header[rpm.RPMTAG_BASENAMES] or [] if header_text(f).endswith('.spec')]
+    import SCLPayload
+    contents = [SCLPayload.read_payload_member(pkg.filename, compressor, fname) for fname in specs]
+    if None in contents:
+        return None
+    return list(zip(specs, contents))
+
+class FileTable(object):
+    '''Files of a package as directory names plus index arrays, like the RPM header has them
+
+    Directory names are kept once each, in dirnames, and decoded upfront.
+    File names are only decoded when asked for by basename() or path(), so
+    checks which look at directories need not touch them at all. Unpacks to
+    (dirnames, basenames, dirindexes).'''
+    __slots__ = ('dirnames', 'dirindexes', '_names', '_paths')
+
+    def __init__(self, dirnames, names, dirindexes, paths=False):
+        self.dirnames = dirnames
+        self.dirindexes = dirindexes
+        self._names = names # basenames as in the header, or whole paths if paths is set
+        self._paths = paths
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter((self.dirnames, self.basenames, self.dirindexes))
+
+    @property
+    def basenames(self):
+        '''List of all basenames, decoded'''
+        return [self.basename(i) for i in range(len(self))]
+
+    def basename(self, i):
+        '''Return basename of file number i'''
+        if self._paths:
+            return self._names[i][len(self.dirnames[self.dirindexes[i]]):]
+        return header_text(self._names[i])
+
+    def path(self, i):
+        '''Return full path of file number i'''
+        if self._paths:
+            return self._names[i]
+        return self.dirnames[self.dirindexes[i]] + header_text(self._names[i])
+
+    def files_in(self, directories):
+        '''Yield numbers of files in given directories (a set of indexes of dirnames), in order'''
+        return itertools.compress(range(len(self)), map(directories.__contains__, self.dirindexes))
+
+
+def file_table(pkg):
+    '''Return FileTable of files in package
+
+    It is read from the header, so the package doesn't need to be extracted.
+    Packages without a header get the table built from pkg.files(), with
+    each directory name interned once and the indexes in an array.'''
+    header = getattr(pkg, 'header', None)
+    if header is not None:
+        basenames = header[rpm.RPMTAG_BASENAMES] or []
+        if not basenames:
+            return FileTable([], [], [])
+        return FileTable([header_text(d) for d in header[rpm.RPMTAG_DIRNAMES]],
+                         basenames, header[rpm.RPMTAG_DIRINDEXES])
+    known = {} # dirname: index
+    intern = known.setdefault
+    paths = list(pkg.files().keys())
+    dirindexes = array.array('l', [intern(fname[:fname.rfind('/')+1], len(known)) for fname in paths])
+    dirnames = sorted(known, key=known.get)
+    return FileTable(dirnames, paths, dirindexes, paths=True)
+
+class PathNode(object):
+    '''Node of PathPolicy trie, one path component'''
+    __slots__ = ('children', 'action', 'files')
+
+    def __init__(self):
+        self.children = {}
+        self.action = None # for the whole tree below
+        self.files = {} # basename: action
+
+
+class PathPolicy(object):
+    '''Rules saying where files of SCL packages belong, compiled into a trie of path components
+
+    Looking up a directory costs one walk down the trie, no matter how many
+    rules there are. See default_path_policy for the format of the rules.'''
+
+    actions = ('scl', 'bad', 'allowed', 'macros', 'runtime')
+
+    def __init__(self, rules):
+        self.root = PathNode()
+        for path, action in rules:
+            self.add(path, action)
+
+    def add(self, path, action):
+        '''Add a rule, it overrides earlier rule for the same path'''
+        if action not in self.actions:
+            raise ValueError('Unknown SCL path policy action %s for %s' % (action, path))
+        parts = [p for p in path.split('/') if p]
+        node = self.root
+        for part in (parts if path.endswith('/') else parts[:-1]):
+            node = node.children.setdefault(part, PathNode())
+        if path.endswith('/'):
+            node.action = action
+        else:
+            node.files[parts[-1]] = action
+
+    def _walk(self, node, parts, i, scl, best, nodes):
+        if node.action is not None and i > best[1]:
+            best[0], best[1] = node.action, i
+        if i == len(parts):
+            if node.files:
+                nodes.append(node)
+            return
+        for key in (parts[i], parts[i] == scl and '%{scl}', '*'):
+            if key and key in node.children:
+                self._walk(node.children[key], parts, i+1, scl, best, nodes)
+
+    def directory(self, dirname, scl):
+        '''Classify a directory of package of given collection
+
+        Return (action of the deepest rule covering the directory or None,
+        trie nodes of the directory with rules for single files).'''
+        best = [None, -1]
+        nodes = []
+        self._walk(self.root, [p for p in dirname.split('/') if p], 0, scl, best, nodes)
+        return best[0], nodes
+
+    def file(self, nodes, basename, scl):
+        '''Return action of a rule for single file in directory given by its nodes or None'''
+        for node in nodes:
+            for key in (basename, basename == scl and '%{scl}', '*'):
+                if key and key in node.files:
+                    return node.files[key]
+        return None
+
+# (SCLPathPolicy option, compiled PathPolicy) used by path_policy()
+_path_policy = (None, None)
+
+def path_policy():
+    '''Return PathPolicy of the defaults and SCLPathPolicy config option, compiled on first use'''
+    global _path_policy
+    extra = Config.getOption('SCLPathPolicy', [])
+    if _path_policy[1] is None or _path_policy[0] != extra:
+        _path_policy = (list(extra), PathPolicy(default_path_policy + list(extra)))
+    return _path_policy[1]
+
+def scl_parts(name):
+    '''Return (collection, last dash separated part) of a package name
+
+    Assume that no dash in package name means no SCL and return None.'''
+    splits = name.split('-')
+    if len(splits) < 2:
+        return None
+    return splits[0], splits[-1]
+
+def files_args(args):
+    '''Split arguments of %files to the package (named as in %package) and the list of -f file lists'''
+    package = []
+    filelists = []
+    tokens = iter(args.split())
+    for token in tokens:
+        if token == '-f':
+            filelists.append(next(tokens, ''))
+        elif token.startswith('-f'):
+            filelists.append(token[2:])
+        else:
+            package.append(token)
+    return ' '.join(package), filelists
+
+# SpecModels of texts given to the text based helpers, least recently used first
+_text_models = collections.OrderedDict()
+_text_models_lock = threading.Lock()
+TEXT_MODELS_SIZE = 16
+
+def text_model(text):
+    '''Return SpecModel of given spec text, the last TEXT_MODELS_SIZE ones are remembered'''
+    with _text_models_lock:
+        model = _text_models.pop(text, None)
+    if model is None:
+        model = SpecModel(text.splitlines(True))
+    with _text_models_lock:
+        _text_models[text] = model
+        while len(_text_models) > TEXT_MODELS_SIZE:
+            _text_models.popitem(last=False)
+    return model
+
+def section_package(name, args):
+    '''Return the package a section is about, '' for the main package and as in %package otherwise'''
+    if name == 'package':
+        return args
+    package = []
+    tokens = iter(args.split())
+    for token in tokens:
+        if token == '--':
+            break # trigger conditions follow
+        if token in ('-f', '-p'):
+            next(tokens, None)
+        elif token == '-n' or not token.startswith('-'):
+            package.append(token)
+    return ' '.join(package)
+
+def split_sections(lines):
+    '''Split spec lines to the preamble and the sections, each one starting with its header
+
+    SpecModel of every part can be built on its own and joined by SpecModel.join().
+    Lines can be given as bytes as well, see read_spec_lines().'''
+    parts = [[]]
+    for line in lines:
+        if isinstance(line, bytes):
+            header = b'%' in line and spec_section.match(decode_spec_line(line).strip())
+        else:
+            header = '%' in line and spec_section.match(line.strip())
+        if header:
+            parts.append([])
+        parts[-1].append(line)
+    return parts
+
+def decode_spec_line(line):
+    '''Decode one line of a spec file the way Pkg.readlines() does'''
     try:
-        return source.index(word)
-    except:
-        return sub
+        return line.decode('UTF-8')
+    except UnicodeError:
+        return line.decode('ISO8859-1')
+
+def read_spec_lines(path, raw=False):
+    '''Yield lines of a spec file the way Pkg.readlines() does, without reading it all at once
+
+    With raw, the lines are not decoded. SpecModel decodes such lines itself
+    and gets the exact byte offsets of everything from them.'''
+    with open(path, 'rb') as fobj:
+        for line in fobj:
+            yield line if raw else decode_spec_line(line)
+
+def split_spec_lines(data, raw=False):
+    '''Yield lines of spec file content the way Pkg.readlines() does, one at a time, see read_spec_lines()'''
+    pos = 0
+    while pos < len(data):
+        end = data.find(b'\n', pos) + 1 or len(data)
+        yield data[pos:end] if raw else decode_spec_line(data[pos:end])
+        pos = end
+
+def header_text(value):
+    '''Return string value of a RPM header tag as str, some rpm versions give bytes'''
+    if value is not None and not isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+# Diagnostics object collecting the output instead of printing it, per thread
+_local = threading.local()
+
+# Where in a spec a diagnostic is, see SpecModel.location(). The subpackage is
+# '' for the main package and named as in %package otherwise, the line counts
+# from 1, start and end are byte offsets in the spec file.
+Location = collections.namedtuple('Location', 'subpackage line start end')
+
+# A section of a spec, see SpecModel.section_index(): its name (package, files,
+# post...), arguments, the package it is about (see section_package()), start
+# and end offsets in the text, line number of its header, start and end byte
+# offsets in the spec file
+Section = collections.namedtuple('Section', 'name args package start end line start_byte end_byte')
+
+def output(pkg, kind, reason, details, location=None):
+    '''Print a diagnostic through Filter and write it to the sink, if there is one'''
+    if kind == 'E':
+        Filter.printError(pkg, reason, *details)
+    else:
+        Filter.printWarning(pkg, reason, *details)
+    if sink is not None:
+        sink.add(pkg.name, kind, reason, details, location)
+
+def report(pkg, kind, reason, details, location=None):
+    '''Output a diagnostic, or collect it when inside of a Diagnostics block'''
+    collector = getattr(_local, 'collector', None)
+    if collector is None:
+        output(pkg, kind, reason, details, location)
+    else:
+        collector.records.append((kind, reason, details))
+        collector.locations.append(location)
+
+def printError(pkg, reason, *details, **kwargs):
+    '''Print an error, or collect it when inside of a Diagnostics block
+
+    Location of the error can be given as location keyword argument.'''
+    report(pkg, 'E', reason, details, kwargs.get('location'))
+
+def printWarning(pkg, reason, *details, **kwargs):
+    '''Print a warning, or collect it when inside of a Diagnostics block
+
+    Location of the warning can be given as location keyword argument.'''
+    report(pkg, 'W', reason, details, kwargs.get('location'))
+
+def enable_sink(path):
+    '''Write all diagnostics to path as well, see SCLSink, until disable_sink()'''
+    global sink
+    import SCLSink, atexit
+    disable_sink()
+    sink = SCLSink.DiagnosticSink(path)
+    atexit.register(sink.close)
+    return sink
+
+def disable_sink():
+    '''Stop writing diagnostics to the sink, write what it has buffered'''
+    global sink
+    res, sink = sink, None
+    if res is not None:
+        res.close()
+    return res
+
+def enable_stats(path=None):
+    '''Start recording SCLStats.Stats, write them to path at exit if given
+
+    Module regexes are replaced by SCLStats.CountingRegex objects until disable_stats().'''
+    for value in list(globals().values()):
+        if isinstance(value, LazyRegex):
+            value.compile()
+    return SCLStats.enable(path, globals())
+
+def disable_stats():
+    '''Stop recording SCLStats.Stats and return them'''
+    return SCLStats.disable(globals())
+
+
+class Diagnostics(object):
+    '''Diagnostics of one package, collected instead of printed
+
+    Use as a context manager around the checks of the package, it only collects
+    diagnostics of the current thread. The object can be pickled and replayed
+    later (and elsewhere) through Filter.'''
+
+    def __init__(self, pkg):
+        # what Filter needs to know about the package
+        self.name = pkg.name
+        self.arch = getattr(pkg, 'arch', None)
+        self.current_linenum = getattr(pkg, 'current_linenum', None)
+        self.records = [] # (type, reason, details)
+        self.locations = [] # Location of every record or None
+        self.stats = None # Stats.pop() result, if stats are enabled
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'collector', None)
+        _local.collector = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.collector = self._previous
+        del self._previous
+        return False
+
+    def count(self, kind):
+        '''Return the number of collected diagnostics of given type (E or W)'''
+        return len([r for r in self.records if r[0] == kind])
+
+    def replay(self):
+        '''Print the collected diagnostics through Filter, write them to the sink'''
+        locations = self.locations or [None] * len(self.records)
+        for (kind, reason, details), location in zip(self.records, locations):
+            output(self, kind, reason, details, location)
+
+
+class SCLConditionals(object):
+    '''Spans of a spec text that are only used when %scl is (or is not) defined
+
+    Found in a single scan of the text: %{?scl:...} blocks (nested and multi
+    line ones as well) and %if branches testing %{?scl} are "defined" spans,
+    %{!?scl:...} blocks and %else branches of those %ifs are "negated" spans.'''
+
+    @instrumented('SCLConditionals')
+    def __init__(self, text):
+        self.text = text
+        defined, negated = [], []
+        braces = [] # None for plain braces, (start, negated) for conditional blocks
+        ifs = [] # None for unrelated %ifs, [branch start, negated] otherwise
+        # branches start on the line after %if or %else, its newline is kept
+        line_end = lambda token: min(token.end() + 1, len(text))
+        for token in scl_cond_token.finditer(text):
+            keyword = token.group(2)
+            if keyword:
+                if keyword.startswith('if'):
+                    cond = scl_cond_if.search(token.group(3))
+                    if cond:
+                        ifs.append([line_end(token), bool(cond.group(1)) != token.group(3).strip().startswith('!')])
+                    else:
+                        ifs.append(None)
+                elif ifs:
+                    branch = ifs[-1]
+                    if branch:
+                        (negated if branch[1] else defined).append((branch[0], token.start()))
+                    if keyword == 'endif':
+                        ifs.pop()
+                    elif keyword == 'else' and branch:
+                        ifs[-1] = [line_end(token), not branch[1]]
+                    else:
+                        ifs[-1] = None
+            elif token.group() == '{':
+                braces.append(None)
+            elif token.group() == '}':
+                if braces:
+                    block = braces.pop()
+                    if block:
+                        (negated if block[1] else defined).append((block[0], token.end()))
+            else:
+                braces.append((token.start(), bool(token.group(1))))
+        # unterminated blocks last till the end
+        for block in braces + ifs:
+            if block:
+                (negated if block[1] else defined).append((block[0], len(text)))
+        self.defined = merge_spans(defined)
+        self.negated = merge_spans(negated)
+        self._starts = ([s[0] for s in self.defined], [s[0] for s in self.negated])
+
+    def inside(self, offset, negated=False):
+        '''Return True if offset is inside a defined (or negated) span, O(log n)'''
+        spans = self.negated if negated else self.defined
+        i = bisect.bisect_right(self._starts[negated], offset) - 1
+        return i >= 0 and offset < spans[i][1]
+
+    def strip(self, negated=False):
+        '''Return the text without defined (or negated) spans'''
+        res = []
+        pos = 0
+        for start, end in (self.negated if negated else self.defined):
+            res.append(self.text[pos:start])
+            pos = end
+        res.append(self.text[pos:])
+        return ''.join(res)
+
+
+class SpecPackage(object):
+    '''Main package or subpackage of a spec with its preamble tags'''
+
+    def __init__(self, args, start):
+        self.args = args # None for the main package, %package arguments otherwise
+        self.start = start
+        self.tags = [] # (tag, value) pairs in the order of appearance
+        self.offsets = [] # offset of the line of every tag
+        self.conditions = [] # condition of every tag, None outside %{?foo:...} blocks
+
+    def get(self, tag, skip=None):
+        '''Return the values of all given tags in this package's preamble, except those under condition skip'''
+        return [value for (t, value), c in zip(self.tags, self.conditions) if t == tag and (skip is None or c != skip)]
+
+    def find(self, tag, skip=None):
+        '''Return (value, offset of its line) of all given tags in this package's preamble, except those under condition skip'''
+        return [(value, offset) for (t, value), offset, c in zip(self.tags, self.offsets, self.conditions)
+                if t == tag and (skip is None or c != skip)]
+
+
+class MacroExpander(object):
+    '''Expands macros of a spec the way a SCL build would, without rpm
+
+    The scl macro is defined as SCL_STANDIN and the macros of scl-utils-build
+    are defined on top of it. %define and %global of the spec are applied in
+    order, those in %{?x:...} and %{!?x:...} blocks only if the condition
+    holds at that point; %if blocks are not evaluated. Name, Version and
+    Release of the main package define name, version and release. Macros that
+    are not defined, parametric macros and builtins such as %{expand:...} are
+    left as they are. Values of macros and expanded strings are memoised.'''
+
+    SCL_STANDIN = '@SCL@'
+    max_depth = 32
+
+    def __init__(self, spec):
+        self.values = {'scl': self.SCL_STANDIN} # macro: unexpanded value
+        self.values.update(scl_utils_macros)
+        for tag in ('Name', 'Version', 'Release'):
+            value = spec.packages[0].get(tag)
+            if value:
+                self.values[tag.lower()] = value[0]
+        for args in spec.calls_of('scl_package', '?scl')[:1]:
+            if args.split():
+                self.values['pkg_name'] = args.split()[0]
+        for name, value, condition in spec.definitions:
+            if condition is None or self.holds(condition):
+                self.values[name] = value
+        self._expanded = {} # macro: expanded value, None while being expanded
+        self._memo = {} # string: expanded string
+
+    def holds(self, condition):
+        '''Return True if condition such as "?scl" or "!?scl" holds'''
+        return (condition.lstrip('!?') in self.values) != ('!' in condition)
+
+    def value(self, name, depth=0):
+        '''Return expanded value of a macro, None if it is not defined or recursive'''
+        if name not in self._expanded:
+            if name not in self.values or depth > self.max_depth:
+                return None
+            self._expanded[name] = None
+            self._expanded[name] = self.expand(self.values[name], depth+1)
+        return self._expanded[name]
+
+    def expand(self, text, depth=0):
+        '''Return text with all known macros expanded'''
+        if '%' not in text:
+            return text
+        if depth == 0 and text in self._memo:
+            return self._memo[text]
+        res = []
+        i = 0
+        while i < len(text):
+            j = text.find('%', i)
+            if j < 0:
+                res.append(text[i:])
+                break
+            res.append(text[i:j])
+            if text[j+1:j+2] == '%':
+                res.append('%')
+                i = j + 2
+            elif text[j+1:j+2] == '{':
+                end = self._closing(text, j+1)
+                if end < 0:
+                    res.append(text[j:])
+                    break
+                res.append(self._braced(text[j:end+1], depth))
+                i = end + 1
+            else:
+                macro = spec_macro.match(text, j)
+                if not macro:
+                    res.append('%')
+                    i = j + 1
+                    continue
+                res.append(self._braced('%{' + text[j+1:macro.end()] + '}', depth))
+                i = macro.end()
+        res = ''.join(res)
+        if depth == 0:
+            self._memo[text] = res
+        return res
+
+    def _closing(self, text, start):
+        '''Return index of the brace closing the one at start, -1 if there is none'''
+        level = 0
+        for i in range(start, len(text)):
+            if text[i] == '{':
+                level += 1
+            elif text[i] == '}':
+                level -= 1
+                if not level:
+                    return i
+        return -1
+
+    def _braced(self, macro, depth):
+        '''Expand one %{...} macro'''
+        inner = macro[2:-1]
+        name = inner.lstrip('!?')
+        flags = inner[:len(inner)-len(name)]
+        name, colon, rest = name.partition(':')
+        if '?' in flags:
+            if not self.holds(flags + name):
+                return ''
+            if colon:
+                return self.expand(rest, depth+1)
+            value = self.value(name, depth)
+            return '' if value is None or '!' in flags else value
+        if colon:
+            return macro
+        value = self.value(name, depth)
+        return macro if value is None else value
+
+
+class SpecModel(object):
+    '''Structured view of a spec file, built by a single pass over its lines
+
+    Holds the packages with their preamble tags, the sections with their spans,
+    macro definitions, lines calling a macro and all macro use sites.
+    Conditions are only recorded for one line %{?foo:...} and %{!?foo:...}
+    blocks, as a string such as "?scl" or "!?scl".
+
+    Lines may be given by an iterator, they are not kept, just the text of
+    the spec. Lines of %changelog without macros are left out of the text,
+    no check needs them and they can be the biggest part of a spec. Lines
+    given as bytes (see read_spec_lines()) are decoded here, byte offsets of
+    lines given as text assume the spec is UTF-8.'''
+
+    @instrumented('SpecModel')
+    def __init__(self, lines):
+        self.packages = [SpecPackage(None, 0)]
+        self.sections = [] # (name, args, start, end)
+        self.definitions = [] # (name, value, condition)
+        self.calls = [] # (name, args, condition, offset)
+        self.macros = [] # (name, flags, start, end)
+        self._conditionals = None
+        self._files = None
+        self._expander = None
+        self._index = None
+        # text offset, line number and byte offset in the file of every line in the text
+        self._line_offsets = array.array('l')
+        self._line_numbers = array.array('l')
+        self._line_bytes = array.array('l')
+        chunks = []
+        preamble = True
+        changelog = False
+        offset = 0
+        self.line_count = 0
+        self.size = 0 # bytes
+        for line in lines:
+            self.line_count += 1
+            if isinstance(line, bytes):
+                size = len(line)
+                self.size += size
+                if changelog and b'%' not in line:
+                    continue
+                line = decode_spec_line(line)
+            else:
+                size = len(line.encode('utf-8'))
+                self.size += size
+                if changelog and '%' not in line:
+                    continue
+            self._line_offsets.append(offset)
+            self._line_numbers.append(self.line_count)
+            self._line_bytes.append(self.size - size)
+            chunks.append(line)
+            # cheap tests of the first character and of substrings go first,
+            # then a single regex match finds what the line is
+            if '%' in line:
+                for macro in spec_macro.finditer(line):
+                    self.macros.append((macro.group(3), macro.group(2), offset+macro.start(), offset+macro.end()))
+            stripped = line.strip()
+            if not stripped:
+                pass
+            elif stripped[0] == '%':
+                directive = spec_directive.match(stripped)
+                if directive:
+                    (section, section_args, condition, inner, definition, value, call, call_args) = directive.groups()
+                    if section:
+                        args = (section_args or '').strip()
+                        if self.sections:
+                            self._close_section(offset)
+                        self.sections.append([section, args, offset, None])
+                        preamble = section == 'package'
+                        changelog = section == 'changelog'
+                        if preamble:
+                            self.packages.append(SpecPackage(args, offset))
+                    elif condition:
+                        if inner.strip():
+                            self._tokenize(inner.strip(), condition, offset, preamble)
+                    elif definition:
+                        self.definitions.append((definition, value.strip(), None))
+                    else:
+                        self.calls.append((call, (call_args or '').strip(), None, offset))
+            elif preamble and ':' in stripped:
+                self._tag(stripped, offset)
+            offset += len(line)+1
+        self.text = '\n'.join(chunks)
+        if self.sections:
+            self._close_section(len(self.text))
+
+    @classmethod
+    def join(cls, parts):
+        '''Return SpecModel of the whole spec from SpecModels of its parts given by split_sections()
+
+        The result is the same as parsing the whole spec at once, parts that
+        did not change can be reused after the spec is edited.'''
+        model = cls.__new__(cls)
+        model.packages = [SpecPackage(None, 0)]
+        model.sections = []
+        model.definitions = []
+        model.calls = []
+        model.macros = []
+        model._conditionals = None
+        model._files = None
+        model._expander = None
+        model._index = None
+        model._line_offsets = array.array('l')
+        model._line_numbers = array.array('l')
+        model._line_bytes = array.array('l')
+        model.line_count = 0
+        model.size = 0
+        texts = []
+        base = 0
+        for part in parts:
+            model._line_offsets.extend(base + o for o in part._line_offsets)
+            model._line_numbers.extend(model.line_count + n for n in part._line_numbers)
+            model._line_bytes.extend(model.size + b for b in part._line_bytes)
+            model.line_count += part.line_count
+            model.size += part.size
+            if not part.text and not part.sections:
+                continue # the preamble of a spec starting with a section
+            if base and model.sections:
+                model._close_section(base)
+            model.packages[0].tags.extend(part.packages[0].tags)
+            model.packages[0].offsets.extend(base + o for o in part.packages[0].offsets)
+            model.packages[0].conditions.extend(part.packages[0].conditions)
+            for package in part.packages[1:]:
+                shifted = SpecPackage(package.args, base + package.start)
+                shifted.tags = package.tags
+                shifted.offsets = [base + o for o in package.offsets]
+                shifted.conditions = package.conditions
+                model.packages.append(shifted)
+            model.sections.extend([name, args, base + start, None] for name, args, start, end in part.sections)
+            model.definitions.extend(part.definitions)
+            model.calls.extend((name, args, condition, base + offset) for name, args, condition, offset in part.calls)
+            model.macros.extend((name, flags, base + start, base + end) for name, flags, start, end in part.macros)
+            texts.append(part.text)
+            base += len(part.text) + 1
+        model.text = '\n'.join(texts)
+        if model.sections:
+            model._close_section(len(model.text))
+        return model
+
+    def _close_section(self, end):
+        section = self.sections[-1]
+        section[3] = end
+        self.sections[-1] = tuple(section)
+
+    def _tag(self, stripped, offset, condition=None):
+        '''Record a preamble tag found on a stripped line'''
+        tag = spec_tag.match(stripped)
+        if tag and not tag.group(2):
+            self.packages[-1].tags.append((tag.group(1), tag.group(3)))
+            self.packages[-1].offsets.append(offset)
+            self.packages[-1].conditions.append(condition)
+
+    def _tokenize(self, stripped, condition, offset, preamble):
+        '''Record a definition, a macro call or a preamble tag found in a one line %{?foo:...} block'''
+        if stripped[0] == '%':
+            definition = spec_definition.match(stripped)
+            if definition:
+                self.definitions.append((definition.group(2), definition.group(4).strip(), condition))
+                return
+            call = spec_call.match(stripped)
+            if call:
+                self.calls.append((call.group(1), (call.group(2) or '').strip(), condition, offset))
+        elif preamble:
+            self._tag(stripped, offset, condition)
+
+    def section_index(self):
+        '''Return Sections of the spec in order of appearance, built on first use
+
+        All the section headers are there: %package, %description, %files,
+        scriptlets, %changelog and the others. Sections and subpackages are
+        looked up by the index in constant time.'''
+        if self._index is None:
+            self._index = []
+            self._by_header = {} # (name, args): first such Section
+            self._by_args = {} # %package args: first such SpecPackage
+            for name, args, start, end in self.sections:
+                line, start_byte = self._line(start)
+                # the last one ends with the file, skipped %changelog lines included
+                end_byte = self.size if end == len(self.text) else self._line(end)[1]
+                section = Section(name, args, section_package(name, args), start, end, line, start_byte, end_byte)
+                self._index.append(section)
+                self._by_header.setdefault((name, args), section)
+            self._starts = [section.start for section in self._index]
+            for package in self.packages[1:]:
+                self._by_args.setdefault(package.args, package)
+        return self._index
+
+    def package(self, args):
+        '''Return the subpackage declared by %package with given arguments or None'''
+        self.section_index()
+        return self._by_args.get(args)
+
+    def find_section(self, name, args=''):
+        '''Return Section of the first section of given name and arguments or None'''
+        self.section_index()
+        return self._by_header.get((name, args))
+
+    def section(self, name, args=''):
+        '''Return (start, end) of the first section of given name and arguments or None'''
+        section = self.find_section(name, args)
+        return section and (section.start, section.end)
+
+    def section_lines(self, name, args=''):
+        '''Return non empty lines of the first section of given name and arguments'''
+        span = self.section(name, args)
+        if not span: return []
+        return self._body_lines(*span)
+
+    def _body_lines(self, start, end):
+        # lines are taken from the text one by one, the section is not copied
+        res = []
+        pos = self.text.find('\n', start, end) # skip the header
+        while pos >= 0:
+            nl = self.text.find('\n', pos+1, end)
+            line = self.text[pos+1:end if nl < 0 else nl].strip()
+            if line:
+                res.append(line)
+            pos = nl
+        return res
+
+    def package_at(self, offset):
+        '''Return the package the spec is about at offset, named as by section_package()'''
+        index = self.section_index()
+        i = bisect.bisect_right(self._starts, offset) - 1
+        if i < 0:
+            return ''
+        return index[i].package
+
+    def _line(self, offset):
+        '''Return (line number, byte offset in the file) of an offset in the text'''
+        i = max(bisect.bisect_right(self._line_offsets, offset) - 1, 0)
+        start = self._line_offsets[i]
+        # lines are joined by an extra separator, which is not in the file
+        end = self._line_offsets[i+1] - 1 if i + 1 < len(self._line_offsets) else len(self.text)
+        return self._line_numbers[i], self._line_bytes[i] + len(self.text[start:min(offset, end)].encode('utf-8'))
+
+    def location(self, start, end=None):
+        '''Return Location of text[start:end], end is the end of the line by default'''
+        if not self._line_offsets:
+            return None
+        if end is None:
+            end = self.text.find('\n', start)
+            if end < 0:
+                end = len(self.text)
+        line, start_byte = self._line(start)
+        return Location(self.package_at(start), line, start_byte, self._line(end)[1])
+
+    def package_location(self, package):
+        '''Return Location of %package line of a subpackage, of the first tag of the main package'''
+        if package.args is None and package.offsets:
+            return self.location(package.offsets[0])
+        return self.location(package.start)
+
+    def files_index(self):
+        '''Return {package: (start, end, file lists)} of %files sections, built on first use
+
+        Packages are named the way %package does ('' for the main package, "name"
+        or "-n name"), -f file lists are left out of the name. Sections end at
+        the next section of any kind, such as %post.'''
+        if self._files is None:
+            self._files = {}
+            for section in self.section_index():
+                if section.name == 'files':
+                    package, filelists = files_args(section.args)
+                    self._files.setdefault(package, (section.start, section.end, filelists))
+        return self._files
+
+    def file_lines(self, package=''):
+        '''Return non empty lines of %files section of given package, see files_index()'''
+        span = self.files_index().get(package)
+        if not span: return []
+        return self._body_lines(span[0], span[1])
+
+    def defines(self, name, value=None, condition=None):
+        '''Return True if there is a definition of given macro (with given value) under given condition'''
+        for d in self.definitions:
+            if d[0] == name and d[2] == condition and (value is None or d[1] == value):
+                return True
+        return False
+
+    def is_metapackage(self):
+        '''Return True if this is a spec of a SCL metapackage, one defining %scl as one word'''
+        for d in self.definitions:
+            if d[0] == 'scl' and d[2] is None and len(d[1].split()) == 1:
+                return True
+        return False
+
+    def calls_of(self, name, condition=None, start=0, end=None):
+        '''Return arguments of all lines calling given macro under given condition in given span'''
+        if end is None: end = len(self.text)
+        return [c[1] for c in self.calls if c[0] == name and c[2] == condition and start <= c[3] < end]
+
+    def macro_sites(self, name, start=0, end=None):
+        '''Return (flags, start, end) of all uses of given macro in given span'''
+        if end is None: end = len(self.text)
+        return [m[1:] for m in self.macros if m[0] == name and start <= m[2] < end]
+
+    def conditionals(self):
+        '''Return SCLConditionals of the spec, computed on first use'''
+        if self._conditionals is None:
+            self._conditionals = SCLConditionals(self.text)
+        return self._conditionals
+
+    def expand(self, text):
+        '''Return text with macros expanded by MacroExpander, created on first use'''
+        if self._expander is None:
+            self._expander = MacroExpander(self)
+        return self._expander.expand(text)
+
+    def uses_macro(self, prefix):
+        '''Return True if any macro starting with given prefix is used in the spec'''
+        for m in self.macros:
+            if m[0].startswith(prefix):
+                return True
+        return False
 
 class SCLCheck(AbstractCheck.AbstractCheck):
     '''Software Collections checks'''
 
     def __init__(self):
+        # No per package state is kept here, the checks may run in many threads at once
         AbstractCheck.AbstractCheck.__init__(self, "SCLCheck")
-        self._spec_file = None
 
+    @instrumented('check_source')
     def check_source(self, pkg):
-        # lookup spec file
+        # lookup spec file in the header and read it straight from the payload,
+        # the whole package is only extracted if that is not possible
+        payloads = spec_payloads(pkg)
+        if payloads is not None:
+            for fname, data in payloads:
+                self.check_spec(pkg, fname, split_spec_lines(data, raw=True))
+            return
         for fname, pkgfile in pkg.files().items():
             if fname.endswith('.spec'):
-                self._spec_file = pkgfile.path
-                self.check_spec(pkg, self._spec_file)
+                self.check_spec(pkg, pkgfile.path)
     
-    def check_spec(self, pkg, spec_file, spec_lines=[]):
-        '''SCL spec file checks'''
-        spec = '\n'.join(Pkg.readlines(spec_file))
-        if global_scl_definition.search(spec):
+    @instrumented('check_spec')
+    def check_spec(self, pkg, spec_file, spec_lines=None):
+        '''SCL spec file checks, spec_lines are used instead of reading spec_file if given
+
+        Return the SpecModel of the spec.'''
+        if spec_lines is None:
+            spec_lines = read_spec_lines(spec_file, raw=True)
+        spec = SpecModel(spec_lines)
+        self.check_spec_model(pkg, spec)
+        return spec
+
+    def check_spec_model(self, pkg, spec):
+        '''SCL spec file checks of a SpecModel'''
+        if spec.is_metapackage():
             self.check_metapackage(pkg, spec)
-        elif scl_package_definition.search(spec):
-            self.check_scl_spec(pkg, spec)
-        elif scl_use.search(spec):
-            printError(pkg, 'undeclared-scl')
+            return
+        for args in spec.calls_of('scl_package', '?scl'):
+            if len(args.split()) == 1:
+                self.check_scl_spec(pkg, spec)
+                return
+        for m in spec.macros:
+            if m[0].startswith('scl'):
+                printError(pkg, 'undeclared-scl', location=spec.location(m[2], m[3]))
+                break
 
+    @instrumented('check_binary')
     def check_binary(self, pkg):
         '''SCL binary package checks'''
-        # Assume that no dash in package name means no SCL
-        splits = pkg.name.split('-')
-        if len(splits) < 2:
+        parts = scl_parts(pkg.name)
+        if not parts:
             return
-        scl_name = splits[0]
+        scl_name = parts[0]
         # While we are here, check if it's a runtime/build package
-        is_runtime = splits[-1] == 'runtime'
-        is_build = splits[-1] == 'build'
-        del splits
+        is_runtime = parts[1] == 'runtime'
+        is_build = parts[1] == 'build'
+        
+        # Only the header is read, files are examined per directory:
+        # each directory is classified once, its files share the result
+        # unless there is a rule for single files in it. Single files are
+        # only looked at in such directories and in those to be reported.
+        policy = path_policy()
+        table = file_table(pkg)
+        directories = [policy.directory(dirname, scl_name) for dirname in table.dirnames]
+        special = set(i for i, (action, nodes) in enumerate(directories) if nodes)
+        actions = {} # file number: action, for files in special directories
+        for i in table.files_in(special):
+            action, nodes = directories[table.dirindexes[i]]
+            actions[i] = policy.file(nodes, table.basename(i), scl_name) or action
+        present = set(action for action, nodes in directories if not nodes)
+        present.update(actions.values())
         
         # Now test if there is /opt/foo/ dir
-        good = False
-        for fname in pkg.files().keys():
-            if startdir.search(fname):
-                good = True
-                break
-        if not good:
+        if 'scl' not in present and 'bad' not in present:
             return
         
         # Test if our dir is named the same way as scl
-        good = True
-        for fname in pkg.files().keys():
-            if not startdir.search(fname):
-                if allowed_etc.search(fname) or allowed_var.search(fname) or fname.startswith('/usr/bin/'):
-                    continue
-                if fname.startswith('/etc/rpm/'):
-                    if not is_build:
-                        printWarning(pkg, 'scl-rpm-macros-outside-of-build', fname)
-                    continue
-                if is_runtime and fname == os.path.join('/etc/scl/prefixes',scl_name):
-                    continue
-                printError(pkg, 'file-outside-of-scl-tree', fname)
-            else:
-                if fname.split('/')[3] != scl_name:
-                    good = False
+        good = 'bad' not in present
+        reported = set(i for i, (action, nodes) in enumerate(directories)
+                       if nodes or action is None or (action == 'macros' and not is_build)
+                       or (action == 'runtime' and not is_runtime))
+        for i in table.files_in(reported):
+            action = actions.get(i, directories[table.dirindexes[i]][0])
+            if action == 'macros':
+                if not is_build:
+                    printWarning(pkg, 'scl-rpm-macros-outside-of-build', table.path(i))
+            elif action is None or (action == 'runtime' and not is_runtime):
+                printError(pkg, 'file-outside-of-scl-tree', table.path(i))
         
         if not good:
             printError(pkg, 'scl-name-screwed-up')
 
+    @instrumented('check_metapackage')
     def check_metapackage(self, pkg, spec):
-        '''SCL metapackage spec checks'''
+        '''SCL metapackage spec checks, spec is a SpecModel'''
         
         # Examine subpackages
-        runtime = subpackage_runtime.search(spec)
+        runtime = spec.package('runtime')
         if not runtime:
             printError(pkg, 'no-runtime-in-scl-metapackage')
         
-        build = subpackage_build.search(spec)
+        build = spec.package('build')
         if not build:
             printError(pkg, 'no-build-in-scl-metapackage')
         else:
-            # Get (B)Rs section for build subpackage
-            end = index_or_sub(spec[build.end():],'%package',-1)
-            if 'scl-utils-build' not in ' '.join(self.get_requires(spec[build.end():end])):
-                printWarning(pkg, 'scl-build-without-requiring-scl-utils-build')
+            # Get Rs of build subpackage
+            if 'scl-utils-build' not in ' '.join(build.get('Requires')):
+                printWarning(pkg, 'scl-build-without-requiring-scl-utils-build', location=spec.package_location(build))
         
-        alien = subpackage_alien.search(spec)
-        if alien:
-            printError(pkg, 'weird-subpackage-in-scl-metapackage', alien.group()[9:])
+        for package in spec.packages[1:]:
+            splits = package.args.split()
+            if splits and splits[0] == '-n':
+                splits = splits[1:]
+            if len(splits) == 1 and not splits[0].startswith(('build','runtime')):
+                printError(pkg, 'weird-subpackage-in-scl-metapackage', package.args, location=spec.package_location(package))
+                break
         
-        # Get (B)Rs section for main package
-        end = index_or_sub(spec,'%package',-1)
-        if 'scl-utils-build' not in ' '.join(self.get_build_requires(spec[:end])):
+        # Get BRs of main package
+        if 'scl-utils-build' not in ' '.join(spec.packages[0].get('BuildRequires')):
             printError(pkg, 'scl-metapackage-without-scl-utils-build-br')
         
         # Enter %install section
-        install_start = index_or_sub(spec,'%install')
-        install_end = index_or_sub(spec,'%check')
-        if not install_end: install_end = index_or_sub(spec,'%clean')
-        if not install_end: install_end = index_or_sub(spec,'%files')
-        if not install_end: install_end = index_or_sub(spec,'%changelog',-1)
+        install = spec.section('install')
         # Search %scl_install
-        if not scl_install.search(spec[install_start:install_end]):
-            printError(pkg, 'scl-metapackage-without-%scl_install')
-        if noarch.search(spec[:install_start]) and libdir.search(spec[install_start:install_end]):
-            printError(pkg, 'noarch-scl-metapackage-with-libdir')
+        if not install or not spec.calls_of('scl_install', None, *install):
+            printError(pkg, 'scl-metapackage-without-%scl_install', location=install and spec.location(install[0]))
+        libdir = install and spec.macro_sites('_libdir', *install)
+        if libdir:
+            for package in spec.packages:
+                if 'noarch' in package.get('BuildArch'):
+                    printError(pkg, 'noarch-scl-metapackage-with-libdir', location=spec.location(*libdir[0][1:]))
+                    break
         
-        # Analyze %files
-        files = self.get_files(spec)
+        # Analyze %files, diagnostics point to the section or to the package without it
+        def files_location(package, args):
+            span = spec.files_index().get(args)
+            return spec.location(span[0]) if span else spec.package_location(package)
+        files = spec.file_lines()
         if files:
-            printWarning(pkg, 'scl-main-metapackage-contains-files', ', '.join(files))
+            printWarning(pkg, 'scl-main-metapackage-contains-files', ', '.join(files),
+                         location=files_location(spec.packages[0], ''))
         if runtime:
-            if not scl_files.search('\n'.join(self.get_files(spec,'runtime'))):
-                printError(pkg, 'scl-runtime-package-without-%scl_files')
+            if not list(filter(scl_files.search, spec.file_lines('runtime'))):
+                printError(pkg, 'scl-runtime-package-without-%scl_files', location=files_location(runtime, 'runtime'))
         if build:
-            if not scl_macros.search('\n'.join(self.get_files(spec,'build'))):
-                printError(pkg, 'scl-build-package-without-rpm-macros')
+            if not list(filter(scl_macros.search, spec.file_lines('build'))):
+                printError(pkg, 'scl-build-package-without-rpm-macros', location=files_location(build, 'build'))
     
+    @instrumented('check_scl_spec')
     def check_scl_spec(self, pkg, spec):
-        '''SCL ready spec checks'''
+        '''SCL ready spec checks, spec is a SpecModel'''
         
         # For the entire spec
-        if not pkg_name.search(spec):
+        if not spec.defines('pkg_name', '%{name}', '!?scl'):
             printWarning(pkg, 'missing-pkg_name-definition')
-        if scl_prefix_noncond.search(self.remove_scl_conds(spec)):
-            printWarning(pkg, 'scl-prefix-without-condition')
-        if not scl_prefix.search(self.get_name(spec)):
-            printError(pkg, 'name-without-scl-prefix')
-        for item in self.get_obsoletes_and_conflicts(spec):
-            if not scl_prefix.search(item):
-                printError(pkg, 'obsoletes-or-conflicts-without-scl-prefix')
+        for flags, start, end in spec.macro_sites('scl_prefix'):
+            if not flags and not spec.conditionals().inside(start):
+                printWarning(pkg, 'scl-prefix-without-condition', location=spec.location(start, end))
                 break
-        for item in self.get_provides(spec):
-            if not scl_prefix.search(item):
-                printError(pkg, 'provides-without-scl-prefix')
+        # literal prefix first, macros are only expanded when it is not there
+        prefix = lambda: spec.expand('%{?scl_prefix}')
+        names = spec.packages[0].find('Name')
+        name_value, offset = names[0] if names else ('', None)
+        if not scl_prefix.search(name_value) and prefix() not in spec.expand(name_value):
+            printError(pkg, 'name-without-scl-prefix', location=None if offset is None else spec.location(offset))
+        for item, offset in self.find_tags(spec, 'Obsoletes', 'Conflicts', 'BuildConflicts'):
+            if not scl_prefix.search(item) and prefix() not in spec.expand(item):
+                printError(pkg, 'obsoletes-or-conflicts-without-scl-prefix', location=spec.location(offset))
                 break
-        setup_opts = setup.search(spec)
-        if setup_opts:
-            if '-n' not in setup_opts.groups()[0]:
-                printError(pkg, 'scl-setup-without-n')
+        for item, offset in self.find_tags(spec, 'Provides'):
+            if not scl_prefix.search(item) and prefix() not in spec.expand(item):
+                printError(pkg, 'provides-without-scl-prefix', location=spec.location(offset))
+                break
+        setup = [c for c in spec.calls if c[0] == 'setup' and c[2] is None]
+        if setup:
+            if '-n' not in setup[0][1]:
+                printError(pkg, 'scl-setup-without-n', location=spec.location(setup[0][3]))
         
         # Examine main package and subpackages one by one
-        borders = []
-        borders.append(0) # main package starts at the beginning
-        while True:
-            more = subpackage_any.search(spec[borders[-1]:])
-            if not more: break
-            splits = more.groups()[1].split()
+        for package in spec.packages[1:]:
+            splits = package.args.split()
             if len(splits) > 1 and splits[0] == '-n':
-                if not scl_prefix_start.search(splits[-1]):
-                    printError(pkg, 'subpackage-with-n-without-scl-prefix')
-            borders.append(borders[-1]+more.end()) # current end is counted only from last one
-        subpackages = [(borders[i],borders[i+1]) for i in range(len(borders)-1)]
-        for subpackage in subpackages:
+                if not scl_prefix_start.search(splits[-1]) and not spec.expand(splits[-1]).startswith(prefix()):
+                    printError(pkg, 'subpackage-with-n-without-scl-prefix', location=spec.package_location(package))
+        # The last package is skipped only to keep the output identical to the
+        # original check, whose loop over section borders never got to it, so
+        # specs with a single package are not examined at all
+        for package in spec.packages[:-1]:
             ok = False
-            for require in self.get_requires(spec[subpackage[0]:subpackage[1]]):
+            for require in package.get('Requires'):
                 # Remove flase entries
-                if not require or require == ':': continue
+                if not require: continue
                 # If it starts with %{name}, it,s fine
                 # If it starts with SCL prefix, it's fine
                 # If it is scl-runtime, it's the best
-                if name_small.search(require) or scl_prefix_start.search(require) or scl_runtime.match(require):
+                if scl_require.match(require):
+                    ok = True
+                    break
+                # The same, hidden behind other macros
+                expanded = spec.expand(require)
+                if expanded.startswith(prefix()) or expanded.startswith(spec.expand('%{name}')):
                     ok = True
                     break
             if not ok:
-                printError(pkg, 'doesnt-require-scl-runtime-or-other-scl-package')
+                printError(pkg, 'doesnt-require-scl-runtime-or-other-scl-package', location=spec.package_location(package))
                 break
         
     
-    def get_requires(self, text, build=False):
-        '''For given piece of spec, find Requires (or BuildRequires)'''
-        if build:
-            search = buildrequires
-        else:
-            search = requires
+    def get_tags(self, spec, *tags):
+        '''For given SpecModel, return values of given tags of all packages'''
+        res = []
+        for package in spec.packages:
+            for tag, value in package.tags:
+                if tag in tags:
+                    res.append(value)
+        return res
+    
+    def find_tags(self, spec, *tags):
+        '''For given SpecModel, return (value, offset of its line) of given tags of all packages
+
+        Tags in %{!?scl:...} blocks are left out, SCL builds don't use them.'''
         res = []
-        while True:
-            more = search.search(text)
-            if not more: break
-            res.extend(more.groups())
-            text = text[more.end():]
+        for package in spec.packages:
+            for (tag, value), offset, condition in zip(package.tags, package.offsets, package.conditions):
+                if tag in tags and condition != '!?scl':
+                    res.append((value, offset))
         return res
+    
+    def get_requires(self, text, build=False):
+        '''For given piece of spec, find Requires (or BuildRequires)'''
+        return span_values(text, iter_requires(text, build=build))
         
     def get_build_requires(self, text):
         '''Call get_requires() with build = True'''
@@ -244,57 +1271,37 @@ class SCLCheck(AbstractCheck.AbstractCheck):
     
     def get_obsoletes_and_conflicts(self, text):
         '''For given piece of spec, find Obsoletes and Conflicts'''
-        res = []
-        while True:
-            more = obsoletes_conflicts.search(text)
-            if not more: break
-            res.extend(more.groups()[2:]) # first group is either 'Obsoletes' or 'Conflicts', second is Build or None
-            text = text[more.end():]
-        return res
+        return span_values(text, iter_obsoletes_and_conflicts(text))
     
     def get_provides(self, text):
         '''For given piece of spec, find Provides'''
-        res = []
-        while True:
-            more = provides.search(text)
-            if not more: break
-            res.extend(more.groups())
-            text = text[more.end():]
-        return res
+        return span_values(text, iter_provides(text))
     
+    @instrumented('get_files')
     def get_files(self, text, subpackage=None):
         '''Return the list of files in %files section for given subpackage or main package'''
+        spec = text_model(text)
         if subpackage:
-            pattern = r'%\{?\??files\}?(\s+-n)?\s+'+subpackage+r'\s*$'
-        else:
-            pattern = r'%\{?\??files\}?\s*$'
-        search = re.search(pattern, text, re.M)
-        if not search: return []
-        
-        start = search.end()
-        end = index_or_sub(text[start:],'%files')
-        if not end: end = index_or_sub(text[start:],'%changelog',-1)
-        return list(filter(None, text[start:start+end].strip().split('\n')))
+            return spec.file_lines(subpackage) or spec.file_lines('-n ' + subpackage)
+        return spec.file_lines()
     
+    @instrumented('remove_scl_conds')
     def remove_scl_conds(self, text):
         '''Returns given text without %scl conds blocks'''
-        while text.count('%{?scl:') > 0:
-            spos = text.index('%{?scl:')
-            pos = spos+7
-            counter = 1
-            while counter:
-                if text[pos] == '{': counter += 1
-                if text[pos] == '}': counter -= 1
-                pos += 1
-            text = text[:spos]+text[pos:]
-        return text
+        return SCLConditionals(text).strip()
         
 
+if os.environ.get('SCLCHECK_STATS') or Config.getOption('SCLStats', None):
+    enable_stats(os.environ.get('SCLCHECK_STATS') or Config.getOption('SCLStats', None))
+if os.environ.get('SCLCHECK_DIAGNOSTICS') or Config.getOption('SCLDiagnostics', None):
+    enable_sink(os.environ.get('SCLCHECK_DIAGNOSTICS') or Config.getOption('SCLDiagnostics', None))
+
 # Create an object to enable the auto registration of the test
 check = SCLCheck()
 
-# Add information about checks
-addDetails(
+def add_details():
+    '''Add information about checks, only printed with -i or -I'''
+    addDetails(
 'undeclared-scl',
 'SPEC contains %scl* macros, but was not recognized as SCL metapackage or SCL ready package. If this should be SCL metapackage, don\'t forget to define %scl macro. If this should be SCL ready package, run %scl conditionalized %scl_package macro, e.g. %{?scl:%scl_package foo}.'
 
@@ -356,8 +1363,15 @@ addDetails(
 'SCl package\'s name starts with SCL prefix. That prefix is used as a directory, where files are stored: If the prefix is foo, the directory is /opt/provides/foo. This package doesn\'t respect that. This means either the name of the package is wrong, or the directory',
 
 'file-outside-of-scl-tree',
-'SCL package should only contain files in /opt/provider/scl-name directory or in other allowed directories such as some directories in /etc or /var. wrapper scripts in /usr/bin are also allowed',
+'SCL package should only contain files in /opt/provider/scl-name directory or in other allowed directories such as some directories in /etc or /var. wrapper scripts in /usr/bin are also allowed. More directories can be allowed with the SCLPathPolicy option, e.g. setOption("SCLPathPolicy", [("/usr/lib/systemd/system/", "allowed")])',
 
 'scl-rpm-macros-outside-of-build',
-'RPM macros in SCL packages shoul belong to -build subpackage of the SCL metapackage'
+'RPM macros in SCL packages shoul belong to -build subpackage of the SCL metapackage',
+
+'doesnt-reach-scl-runtime',
+'When the whole collection is checked at once, every package of the collection should require the %{scl}-runtime package, directly or through other packages of the collection'
 )
+
+# rpmlint sets Config.info before loading the checks
+if getattr(Config, 'info', True):
+    add_details()
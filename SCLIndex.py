@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLIndex.py
+# Package       : rpmlint
+# Purpose       : Collection-wide dependency checks of Software Collections.
+#############################################################################
+
+'''Collection-wide dependency index of Software Collections packages
+
+SCLCheck can only tell that a package requires something from its collection.
+When a whole collection is checked at once, phase one streams the name,
+Provides and Requires of every package (from binary RPM headers, or of every
+subpackage of a spec file) into a DependencyIndex. Phase two reports packages
+that do not transitively require the runtime package of their collection.'''
+
+import tempfile
+
+import rpm
+import Config
+import Pkg
+import SCLCheck
+
+# Versions are dropped from Requires and Provides values
+operators = ('<', '<=', '=', '==', '>=', '>')
+
+def capability_names(value):
+    '''Return names of the capabilities in a Requires or Provides value, without versions'''
+    names = []
+    tokens = iter(value.replace(',', ' ').split())
+    for token in tokens:
+        if token in operators:
+            next(tokens, None)
+        else:
+            names.append(token)
+    return names
+
+def spec_entries(spec):
+    '''Return (name, provides, requires, examined) of every package of a SpecModel
+
+    Macros are expanded by MacroExpander, tags in %{!?scl:...} blocks are left
+    out as SCL builds don't use them. All packages are examined, except the
+    main package, -runtime, -build and -scldevel of a metapackage.'''
+    res = []
+    main = spec.expand(' '.join(spec.packages[0].get('Name')[:1]))
+    metapackage = spec.is_metapackage()
+    for package in spec.packages:
+        if package.args is None:
+            name = main
+        else:
+            splits = package.args.split()
+            if len(splits) > 1 and splits[0] == '-n':
+                name = spec.expand(splits[-1])
+            else:
+                name = '%s-%s' % (main, spec.expand(package.args))
+        provides = [name]
+        for value in package.get('Provides', skip='!?scl'):
+            provides.extend(capability_names(spec.expand(value)))
+        requires = []
+        for value in package.get('Requires', skip='!?scl'):
+            requires.extend(capability_names(spec.expand(value)))
+        part = package.args is None or package.args in ('runtime', 'build', 'scldevel')
+        res.append((name, provides, requires, not (metapackage and part)))
+    return res
+
+def package_entries(pkg):
+    '''Return (origin, entries) of a RPM package, read from its header, see entries()'''
+    if pkg.isSource():
+        return pkg.name, []
+    header = pkg.header
+    texts = lambda tag: [SCLCheck.header_text(v) for v in header[tag] or []]
+    return pkg.name, [(pkg.name, [pkg.name] + texts(rpm.RPMTAG_PROVIDENAME), texts(rpm.RPMTAG_REQUIRENAME), True)]
+
+def entries(path):
+    '''Return (origin, entries) of a spec file or a binary RPM for DependencyIndex.add()
+
+    Origin is the name diagnostics are reported for, entries are given by
+    spec_entries(), source RPMs have none.'''
+    if path.endswith('.spec'):
+        return path, spec_entries(SCLCheck.SpecModel(SCLCheck.read_spec_lines(path, raw=True)))
+    pkg = Pkg.Pkg(path, Config.getOption('ExtractDir', tempfile.gettempdir()))
+    try:
+        return package_entries(pkg)
+    finally:
+        pkg.cleanup()
+
+
+class DependencyIndex(object):
+    '''Packages of one or more collections with what they provide and require
+
+    Phase one: add() entries of all packages, the spec ones use a stand-in
+    collection name (see MacroExpander), which is replaced by the collection
+    name when there is just one. Phase two: finish() interns package and
+    capability names to numbers, then reaching() and problems() traverse
+    the graph, with the results memoised per capability.'''
+
+    def __init__(self):
+        self.entries = [] # (origin, name, provides, requires, examined)
+        self.names = None
+
+    def add(self, origin, entries):
+        '''Add (name, provides, requires, examined) entries of packages reported as origin'''
+        for name, provides, requires, examined in entries:
+            self.entries.append((origin, name, provides, requires, examined))
+
+    def collections(self):
+        '''Return names of collections with their runtime package in the index'''
+        res = set()
+        for origin, name, provides, requires, examined in self.entries:
+            parts = SCLCheck.scl_parts(name)
+            if parts and name == parts[0] + '-runtime' and SCLCheck.MacroExpander.SCL_STANDIN not in name:
+                res.add(parts[0])
+        return sorted(res)
+
+    def finish(self):
+        '''End phase one, build the graph'''
+        self.collection_names = collections = self.collections()
+        standin = SCLCheck.MacroExpander.SCL_STANDIN
+        real = collections[0] if len(collections) == 1 else standin
+        fix = lambda name: name.replace(standin, real) if standin in name else name
+        capabilities = {} # name: number
+        intern = lambda name: capabilities.setdefault(fix(name), len(capabilities))
+        self.names = []
+        self.origins = []
+        self.examined = []
+        self.requires = [] # package: tuple of capabilities
+        providers = {} # capability: list of packages
+        for package, (origin, name, provides, requires, examined) in enumerate(self.entries):
+            self.names.append(fix(name))
+            self.origins.append(origin)
+            self.examined.append(examined)
+            self.requires.append(tuple(set(intern(c) for c in requires)))
+            for capability in set(intern(c) for c in provides):
+                providers.setdefault(capability, []).append(package)
+        self.entries = None
+        self.capabilities = capabilities
+        self.providers = providers
+        self._required_by = None
+        self._reaching = {}
+
+    def required_by(self):
+        '''Return for every package the list of packages requiring something it provides'''
+        if self._required_by is None:
+            self._required_by = [[] for name in self.names]
+            for package, requires in enumerate(self.requires):
+                for capability in requires:
+                    for provider in self.providers.get(capability, ()):
+                        self._required_by[provider].append(package)
+        return self._required_by
+
+    def reaching(self, capability):
+        '''Return the set of packages providing a capability or transitively requiring it'''
+        number = self.capabilities.get(capability)
+        if number not in self._reaching:
+            required_by = self.required_by()
+            reached = set(self.providers.get(number, ()))
+            todo = list(reached)
+            while todo:
+                for package in required_by[todo.pop()]:
+                    if package not in reached:
+                        reached.add(package)
+                        todo.append(package)
+            self._reaching[number] = reached
+        return self._reaching[number]
+
+    def reaches_runtime(self, name):
+        '''Return True if all packages of given name transitively require the runtime of their collection'''
+        parts = SCLCheck.scl_parts(name)
+        if not parts:
+            return False
+        reached = self.reaching(parts[0] + '-runtime')
+        return all(p in reached for p, n in enumerate(self.names) if n == name)
+
+    def problems(self):
+        '''Yield (origin, name) of examined packages of indexed collections not reaching their runtime
+
+        Parts of the metapackage itself (the main package, -runtime, -build
+        and -scldevel) are not examined.'''
+        for package, name in enumerate(self.names):
+            parts = SCLCheck.scl_parts(name)
+            if not self.examined[package] or not parts or parts[0] not in self.collection_names:
+                continue
+            if name == '-'.join(parts) and parts[1] in ('runtime', 'build', 'scldevel'):
+                continue
+            if package not in self.reaching(parts[0] + '-runtime'):
+                yield self.origins[package], name
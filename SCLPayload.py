@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLPayload.py
+# Package       : rpmlint
+# Purpose       : Reading single files from RPM payloads.
+#############################################################################
+
+'''Read a single file from the payload of a RPM without extracting it
+
+Used by SCLCheck to get spec files of source RPMs: the payload is
+decompressed as a stream and the cpio archive is skipped through up to
+the wanted member. Payloads compressed by gzip, bzip2, xz and lzma are
+supported, the last two only where Python has the lzma module.'''
+
+import struct, zlib
+
+from SCLStats import instrumented
+
+def payload_decompressor(compressor):
+    '''Return (decompressor object, exception class of its errors) for given RPM
+    payload compressor or (None, None) if unsupported'''
+    if compressor in (None, '', 'gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS), zlib.error
+    if compressor == 'bzip2':
+        import bz2
+        return bz2.BZ2Decompressor(), IOError
+    if compressor in ('xz', 'lzma'):
+        try:
+            import lzma
+        except ImportError:
+            return None, None
+        return lzma.LZMADecompressor(), lzma.LZMAError
+    return None, None
+
+
+class PayloadStream(object):
+    '''Decompressed RPM payload, read from a file in chunks'''
+
+    def __init__(self, fobj, decompressor, chunk=65536):
+        self.fobj = fobj
+        self.decompressor = decompressor
+        self.chunk = chunk
+        self.buffer = b''
+
+    def _fill(self):
+        data = self.fobj.read(self.chunk)
+        if not data:
+            return False
+        self.buffer += self.decompressor.decompress(data)
+        return True
+
+    def read(self, size):
+        '''Return next size bytes, less at the end of the payload'''
+        while len(self.buffer) < size and self._fill():
+            pass
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def skip(self, size):
+        '''Throw away next size bytes without keeping them in memory'''
+        while size > len(self.buffer):
+            size -= len(self.buffer)
+            self.buffer = b''
+            if not self._fill():
+                return
+        self.buffer = self.buffer[size:]
+
+
+def skip_rpm_headers(fobj):
+    '''Move RPM file object from its start to the start of the payload'''
+    fobj.seek(96) # lead
+    for padded in (True, False): # signature header is padded to 8 bytes
+        intro = fobj.read(16)
+        if len(intro) != 16 or intro[:3] != b'\x8e\xad\xe8':
+            raise ValueError('not a RPM header')
+        nindex, hsize = struct.unpack('>II', intro[8:])
+        size = 16 * nindex + hsize
+        if padded:
+            size += (8 - (size % 8)) % 8
+        fobj.seek(size, 1)
+
+@instrumented('read_payload_member')
+def read_payload_member(filename, compressor, wanted):
+    '''Return content of a file from the payload of a RPM without extracting the others
+
+    The cpio archive is streamed and only the wanted member is kept in memory.
+    Return None if it is not found or the payload can't be read this way.'''
+    decompressor, error = payload_decompressor(compressor)
+    if decompressor is None:
+        return None
+    wanted = wanted.lstrip('/')
+    fobj = open(filename, 'rb')
+    try:
+        skip_rpm_headers(fobj)
+        stream = PayloadStream(fobj, decompressor)
+        while True:
+            header = stream.read(110)
+            if len(header) != 110 or header[:5] != b'07070':
+                return None # not a (new ascii) cpio archive
+            namesize = int(header[94:102], 16)
+            filesize = int(header[54:62], 16)
+            name = stream.read(namesize)[:-1].decode('utf-8', 'replace')
+            stream.skip((4 - (110 + namesize) % 4) % 4)
+            if name == 'TRAILER!!!':
+                return None
+            if name.startswith('./'):
+                name = name[2:]
+            if name.lstrip('/') == wanted:
+                return stream.read(filesize)
+            stream.skip(filesize + (4 - filesize % 4) % 4)
+    except (ValueError, IOError, EOFError, error):
+        return None
+    finally:
+        fobj.close()
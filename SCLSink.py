@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLSink.py
+# Package       : rpmlint
+# Purpose       : Machine readable output of Software Collections checks.
+#############################################################################
+
+'''Machine readable output of SCLCheck diagnostics
+
+Set SCLCHECK_DIAGNOSTICS environment variable (or SCLDiagnostics config
+option) to a path and every diagnostic is also written there, besides the
+usual text output. Diagnostics are buffered and written in bulk, always
+after the last one of a package. Files ending with .jsonl or .json get JSON
+Lines, one object per diagnostic, anything else gets the compact columnar
+format of ColumnarWriter. read() yields the records of either one.
+
+Every record has the fields below: type (E or W), check id, package,
+subpackage ('' for the main package, as %package names it otherwise), line
+of the spec (from 1) and start and end byte offsets in the spec, and the
+details. Locations are None when a diagnostic has none, such as those of
+binary packages.'''
+
+import json, struct, threading
+
+fields = ('type', 'check', 'package', 'subpackage', 'line', 'start', 'end', 'details')
+
+def text(value):
+    '''Return value as text, byte strings are decoded (file names from RPM headers are such on Python 2)'''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return '%s' % value
+
+def record(package, kind, reason, details, location):
+    '''Return a record of a diagnostic, location is SCLCheck.Location or None'''
+    subpackage, line, start, end = location or (None, None, None, None)
+    if subpackage is not None:
+        subpackage = text(subpackage)
+    return (text(kind), text(reason), text(package), subpackage, line, start, end, [text(d) for d in details])
+
+
+class JSONLinesWriter(object):
+    '''Writes records as JSON objects, one per line'''
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+
+    def write(self, records):
+        self.fobj.write(''.join(json.dumps(dict(zip(fields, r)), sort_keys=True) + '\n'
+                                for r in records).encode('utf-8'))
+
+
+class ColumnarWriter(object):
+    '''Writes records in blocks, one block per write() call
+
+    A block starts with MAGIC, the format version, the number of records and
+    the number of strings (struct <4sBII), then come the strings (each one
+    as <I length and UTF-8 bytes), then one column of <I per field and the
+    details of all records as one more column. String fields and details
+    are indexes of the strings, the details field is the number of details
+    of the record, NONE stands for None.'''
+
+    MAGIC = b'SCLD'
+    VERSION = 2
+    NONE = 0xffffffff
+    strings = ('type', 'check', 'package', 'subpackage')
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+
+    def write(self, records):
+        table = {} # string: index
+        columns = [[] for f in fields]
+        details = []
+        for r in records:
+            for i, value in enumerate(r):
+                if value is None:
+                    value = self.NONE
+                elif fields[i] == 'details':
+                    details.extend(table.setdefault(d, len(table)) for d in value)
+                    value = len(value)
+                elif fields[i] in self.strings:
+                    value = table.setdefault(value, len(table))
+                columns[i].append(value)
+        columns.append(details)
+        strings = sorted(table, key=table.get)
+        chunks = [struct.pack('<4sBII', self.MAGIC, self.VERSION, len(records), len(strings))]
+        for string in strings:
+            data = string.encode('utf-8')
+            chunks.append(struct.pack('<I', len(data)))
+            chunks.append(data)
+        for column in columns:
+            chunks.append(struct.pack('<%dI' % len(column), *column))
+        self.fobj.write(b''.join(chunks))
+
+    @classmethod
+    def read(cls, data):
+        '''Yield records of all blocks in data'''
+        pos = 0
+        header = struct.calcsize('<4sBII')
+        while pos < len(data):
+            magic, version, rows, count = struct.unpack_from('<4sBII', data, pos)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError('not a block of SCLCheck diagnostics at byte %d' % pos)
+            pos += header
+            strings = []
+            for i in range(count):
+                size = struct.unpack_from('<I', data, pos)[0]
+                strings.append(data[pos+4:pos+4+size].decode('utf-8'))
+                pos += 4 + size
+            columns = []
+            for field in fields:
+                column = struct.unpack_from('<%dI' % rows, data, pos)
+                pos += 4 * rows
+                if field in cls.strings:
+                    column = [None if v == cls.NONE else strings[v] for v in column]
+                else:
+                    column = [None if v == cls.NONE else v for v in column]
+                columns.append(column)
+            details = struct.unpack_from('<%dI' % sum(columns[-1]), data, pos)
+            pos += 4 * len(details)
+            first = 0
+            for r in zip(*columns):
+                r = list(r)
+                count = r[-1]
+                r[-1] = [strings[v] for v in details[first:first+count]]
+                first += count
+                yield tuple(r)
+
+
+class DiagnosticSink(object):
+    '''Buffers records of diagnostics and appends them to a file in bulk
+
+    The buffer is written once it holds batch records and the package
+    changes, and on flush() and close(). Can be shared by threads.'''
+
+    def __init__(self, path, batch=1000):
+        self.path = path
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.fobj = open(path, 'ab')
+        if path.endswith(('.jsonl', '.json')):
+            self.writer = JSONLinesWriter(self.fobj)
+        else:
+            self.writer = ColumnarWriter(self.fobj)
+        self.pending = []
+        self.package = None
+
+    def add(self, package, kind, reason, details, location=None):
+        '''Add a diagnostic of a package'''
+        with self.lock:
+            if package != self.package and len(self.pending) >= self.batch:
+                self._write()
+            self.package = package
+            self.pending.append(record(package, kind, reason, details, location))
+
+    def _write(self):
+        if self.pending:
+            self.writer.write(self.pending)
+            self.pending = []
+
+    def flush(self):
+        '''Write all buffered records'''
+        with self.lock:
+            self._write()
+            self.fobj.flush()
+
+    def close(self):
+        '''Write all buffered records and close the file'''
+        with self.lock:
+            if not self.fobj.closed:
+                self._write()
+                self.fobj.close()
+
+def read(path):
+    '''Yield records of a file written by DiagnosticSink as dictionaries'''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(ColumnarWriter.MAGIC):
+        for r in ColumnarWriter.read(data):
+            yield dict(zip(fields, r))
+    else:
+        for line in data.decode('utf-8').splitlines():
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLStats.py
+# Package       : rpmlint
+# Purpose       : Timing and counter instrumentation of Software Collections checks.
+#############################################################################
+
+'''Timings and counters of SCLCheck methods
+
+Methods decorated by instrumented() record their wall time, calls, regex
+searches and scanned characters per package in Stats, while stats are
+enabled by SCLCheck.enable_stats(). Set SCLCHECK_STATS environment variable
+(or SCLStats config option) to a path to get them written there at exit.'''
+
+import functools, re, threading, time
+
+# Stats of the current run, see enable()
+stats = None
+
+# counters of instrumented methods being run, per thread
+_local = threading.local()
+
+
+class CountingRegex(object):
+    '''Compiled regex counting its searches and scanned characters into Stats of the running check'''
+
+    def __init__(self, regex):
+        self.regex = regex
+
+    def __getattr__(self, attr):
+        return getattr(self.regex, attr)
+
+    def _count(self, string, pos=0, endpos=None):
+        frames = getattr(_local, 'stats_frames', None)
+        if frames:
+            frames[-1][0] += 1
+            frames[-1][1] += (len(string) if endpos is None else min(endpos, len(string))) - pos
+
+    def search(self, string, *args):
+        self._count(string, *args)
+        return self.regex.search(string, *args)
+
+    def match(self, string, *args):
+        self._count(string, *args)
+        return self.regex.match(string, *args)
+
+    def finditer(self, string, *args):
+        self._count(string, *args)
+        return self.regex.finditer(string, *args)
+
+    def findall(self, string, *args):
+        self._count(string, *args)
+        return self.regex.findall(string, *args)
+
+
+class Stats(object):
+    '''Wall time, calls, regex searches and scanned characters per instrumented method and package
+
+    Methods record themselves with the instrumented decorator, only while
+    stats are enabled. Times and counts of nested calls are included in the
+    calling method as well.'''
+
+    fields = ('seconds', 'calls', 'regex_calls', 'regex_chars')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.packages = {} # name: {method: [seconds, calls, regex_calls, regex_chars]}
+        self.seconds = {} # name: seconds of all checks of the package
+
+    def call(self, method, function, args, kwargs):
+        '''Call function, record it as method of the package being checked'''
+        frames = getattr(_local, 'stats_frames', None)
+        if frames is None:
+            frames = _local.stats_frames = []
+        if not frames:
+            # checks get (self, pkg, ...), anything else is counted for no package
+            _local.stats_package = getattr(args[1], 'name', '(none)') if len(args) > 1 else '(none)'
+        frame = [0, 0]
+        frames.append(frame)
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            frames.pop()
+            if frames:
+                frames[-1][0] += frame[0]
+                frames[-1][1] += frame[1]
+            with self.lock:
+                self._add(_local.stats_package, {method: [seconds, 1] + frame}, None if frames else seconds)
+
+    def _add(self, package, methods, seconds):
+        counters = self.packages.setdefault(package, {})
+        for method, values in methods.items():
+            counters[method] = [a + b for a, b in zip(counters.get(method, [0, 0, 0, 0]), values)]
+        if seconds is not None:
+            self.seconds[package] = self.seconds.get(package, 0) + seconds
+
+    def pop(self, package):
+        '''Remove and return (methods, seconds) recorded for a package, to be merged elsewhere'''
+        with self.lock:
+            return self.packages.pop(package, {}), self.seconds.pop(package, 0)
+
+    def merge(self, package, recorded):
+        '''Add (methods, seconds) returned by pop(), possibly in other process'''
+        with self.lock:
+            self._add(package, recorded[0], recorded[1])
+
+    def methods(self):
+        '''Return {method: {field: value}} summed over all packages'''
+        res = {}
+        for counters in list(self.packages.values()):
+            for method, values in counters.items():
+                res[method] = [a + b for a, b in zip(res.get(method, [0, 0, 0, 0]), values)]
+        return dict((method, dict(zip(self.fields, values))) for method, values in res.items())
+
+    def slowest(self, count=10):
+        '''Return [(package, seconds)] of count packages with the slowest checks'''
+        return sorted(self.seconds.items(), key=lambda item: (-item[1], item[0]))[:count]
+
+    def to_json(self, count=10):
+        '''Return JSON with the totals per method and per package and the slowest packages'''
+        packages = dict((package, dict((method, dict(zip(self.fields, values))) for method, values in counters.items()))
+                        for package, counters in self.packages.items())
+        import json
+        return json.dumps({'methods': self.methods(), 'packages': packages, 'slowest': self.slowest(count)},
+                          indent=1, sort_keys=True)
+
+    def to_prometheus(self):
+        '''Return the totals per method in Prometheus text exposition format'''
+        lines = []
+        methods = self.methods()
+        for field, help in [('seconds', 'Wall time spent in SCLCheck methods'),
+                            ('calls', 'Calls of SCLCheck methods'),
+                            ('regex_calls', 'Regular expression searches by SCLCheck methods'),
+                            ('regex_chars', 'Characters scanned by regular expressions of SCLCheck methods')]:
+            lines.append('# HELP sclcheck_%s_total %s' % (field, help))
+            lines.append('# TYPE sclcheck_%s_total counter' % field)
+            for method in sorted(methods):
+                lines.append('sclcheck_%s_total{method="%s"} %r' % (field, method, methods[method][field]))
+        lines.append('# HELP sclcheck_packages_total Packages checked by SCLCheck')
+        lines.append('# TYPE sclcheck_packages_total counter')
+        lines.append('sclcheck_packages_total %d' % len(self.seconds))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Write Prometheus text if path ends with .prom, JSON otherwise'''
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+def instrumented(method):
+    '''Decorator recording Stats of the calls as given method name, if stats are enabled'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if stats is None:
+                return function(*args, **kwargs)
+            return stats.call(method, function, args, kwargs)
+        return wrapper
+    return decorator
+
+def enable(path=None, namespace=None):
+    '''Start recording Stats, write them to path (see Stats.write()) at exit if given
+
+    Compiled regexes in namespace, globals() of a module, are replaced by
+    CountingRegex objects until disable().'''
+    global stats
+    if stats is None:
+        stats = Stats()
+        pattern = type(re.compile(''))
+        for key, value in list((namespace or {}).items()):
+            if isinstance(value, pattern):
+                namespace[key] = CountingRegex(value)
+    if path:
+        import atexit
+        atexit.register(stats.write, path)
+    return stats
+
+def disable(namespace=None):
+    '''Stop recording Stats and return them, put the regexes in namespace back'''
+    global stats
+    res, stats = stats, None
+    for key, value in list((namespace or {}).items()):
+        if isinstance(value, CountingRegex):
+            namespace[key] = value.regex
+    return res
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#############################################################################
+# File          : SCLWatch.py
+# Package       : rpmlint
+# Purpose       : Incremental Software Collections checks of edited specs.
+#############################################################################
+
+'''Check spec files again whenever they change, reparsing only changed sections
+
+Usage: python SCLWatch.py [-i seconds] spec...
+       python SCLWatch.py --server
+The first form polls given spec files (every second by default) and prints
+the diagnostics of each one that was saved. The second one reads JSON
+requests from stdin, one per line, and writes one JSON response per line:
+  {"id": 1, "path": "foo.spec"}                  check the file on disk
+  {"id": 2, "path": "foo.spec", "text": "..."}   check unsaved content
+  {"id": 3, "path": "foo.spec", "close": true}   forget the spec
+Responses look like {"id": 1, "path": "foo.spec", "diagnostics":
+[["E", "reason", [details]]], "locations": [[subpackage, line, start, end]],
+"reparsed": 1, "rechecked": false, "sections": 12, "ms": 0.4} or {"id": 1, "error": "message"},
+locations are null for diagnostics without one, see SCLSink for the fields.'''
+
+import bisect, getopt, json, os, sys, time
+
+import Pkg
+import SCLCheck
+
+def common_ends(old, new):
+    '''Return lengths of the common prefix and suffix of two lists, not overlapping'''
+    step = 256 # lines compared at once before going one by one
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix:prefix+step] == new[prefix:prefix+step]:
+        prefix += step
+    prefix = min(prefix, limit)
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    limit -= prefix
+    suffix = 0
+    while suffix + step <= limit and old[len(old)-suffix-step:len(old)-suffix] == new[len(new)-suffix-step:len(new)-suffix]:
+        suffix += step
+    while suffix < limit and old[len(old)-suffix-1] == new[len(new)-suffix-1]:
+        suffix += 1
+    return prefix, suffix
+
+
+class SpecPart(object):
+    '''The preamble or a section of a spec, see SCLCheck.split_sections()
+
+    Besides its SpecModel, it has the facts the checks of the spec need to
+    know about it, unless it declares a package: definitions, %setup and
+    %scl_package calls, uses of %scl* macros (with their part relative
+    Locations) and %scl conditionals. Parts with the same facts can stand
+    in for each other without changing what the checks find.'''
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.model = model = SCLCheck.SpecModel(lines)
+        self.facts = None
+        if model.packages[0].tags or len(model.packages) > 1:
+            return
+        calls = tuple(c + (model.location(c[3]),) for c in model.calls if c[0] in ('setup', 'scl_package'))
+        macros = tuple(m + (model.location(m[2], m[3]),) for m in model.macros if m[0].startswith('scl'))
+        if macros:
+            # every %scl conditional uses %scl, so without them only the
+            # nesting of %ifs and of braces matters to the other parts
+            conditionals = tuple((t.group(), t.start()) for t in SCLCheck.scl_cond_token.finditer(model.text))
+        else:
+            keywords, depth, lowest = [], 0, 0
+            for token in SCLCheck.scl_cond_token.finditer(model.text):
+                if token.group(2):
+                    keywords.append(token.group(2))
+                else:
+                    depth += 1 if token.group() == '{' else -1
+                    lowest = min(lowest, depth)
+            conditionals = (tuple(keywords), lowest, depth)
+        self.facts = (tuple(model.definitions), calls, macros, conditionals)
+
+
+class SpecSession(object):
+    '''Parsed parts of one spec kept in memory between checks of its versions'''
+
+    def __init__(self, path):
+        self.path = path
+        self.pkg = Pkg.FakePkg(path)
+        self.lines = []
+        self.parts = [] # SpecParts of the current version
+        self.diags = None
+        self.inputs = None # what the checks saw, see _inputs()
+        self.located = None # part relative locations of the diagnostics
+        self.reparsed = 0
+        self.rechecked = False
+
+    def _update(self, lines):
+        '''Replace the parts covering lines that differ from the previous version'''
+        prefix, suffix = common_ends(self.lines, lines)
+        old_end = len(self.lines) - suffix
+        starts = [0]
+        for part in self.parts:
+            starts.append(starts[-1] + len(part.lines))
+        # parts touching the changed lines, a line inserted at a part border
+        # goes to the part before it
+        first = min(bisect.bisect_right(starts, prefix), len(self.parts)) - 1
+        last = max(bisect.bisect_left(starts, old_end), first + 1)
+        while True:
+            start, end = starts[first], starts[last] + len(lines) - len(self.lines)
+            parts = SCLCheck.split_sections(lines[start:end])
+            if start == 0 or not parts[0]:
+                break
+            # the first line is no longer a section header
+            first -= 1
+        if start:
+            del parts[0]
+        else:
+            first = 0 # an empty preamble is replaced as well
+        new = [SpecPart(part) for part in parts]
+        self.parts[first:last] = new
+        self.lines = lines
+        self.reparsed = len(new)
+
+    def _inputs(self):
+        '''Return what check_spec_model() needs to know about the parts
+
+        Parts declaring packages are needed whole, so is every part of a
+        metapackage spec. Other parts only matter by their facts.'''
+        if any(part.model.is_metapackage() for part in self.parts):
+            return list(self.parts)
+        return [part if part.facts is None else part.facts for part in self.parts]
+
+    def check(self, lines):
+        '''Return Diagnostics of the spec given by its lines
+
+        Only sections that changed since the previous version are parsed, by
+        comparing the lines, and the checks are only run again when their
+        inputs changed; otherwise the previous diagnostics are given, moved
+        to where their parts are now.'''
+        lines = list(lines)
+        if not self.parts:
+            self.lines, self.parts = lines, [SpecPart(part) for part in SCLCheck.split_sections(lines)]
+            self.reparsed = len(self.parts)
+        elif lines != self.lines:
+            self._update(lines)
+        else:
+            self.reparsed = 0
+        line_starts, byte_starts = [0], [0]
+        for part in self.parts:
+            line_starts.append(line_starts[-1] + part.model.line_count)
+            byte_starts.append(byte_starts[-1] + part.model.size)
+        inputs = self._inputs()
+        self.rechecked = inputs != self.inputs
+        if self.rechecked:
+            with SCLCheck.Diagnostics(self.pkg) as diags:
+                SCLCheck.check.check_spec_model(self.pkg, SCLCheck.SpecModel.join([part.model for part in self.parts]))
+            self.located = []
+            for location in diags.locations:
+                if location is not None:
+                    i = bisect.bisect_right(line_starts, location.line - 1, 0, len(self.parts)) - 1
+                    location = (i, location.subpackage, location.line - line_starts[i],
+                                location.start - byte_starts[i], location.end - byte_starts[i])
+                self.located.append(location)
+            self.inputs, self.diags = inputs, diags
+        elif self.reparsed:
+            diags = SCLCheck.Diagnostics(self.pkg)
+            diags.records = list(self.diags.records)
+            for location in self.located:
+                if location is not None:
+                    i, subpackage, line, start, end = location
+                    location = SCLCheck.Location(subpackage, line_starts[i] + line, byte_starts[i] + start, byte_starts[i] + end)
+                diags.locations.append(location)
+            self.diags = diags
+        return self.diags
+
+    def check_file(self):
+        '''Return Diagnostics of the spec file as it is on disk'''
+        return self.check(SCLCheck.read_spec_lines(self.path, raw=True))
+
+
+class Server(object):
+    '''JSON lines protocol over a pair of file objects, see the module docstring'''
+
+    def __init__(self, inp=sys.stdin, out=sys.stdout):
+        self.inp = inp
+        self.out = out
+        self.sessions = {} # path: SpecSession
+
+    def handle(self, request):
+        '''Return the response to a request given as a dictionary'''
+        path = request['path']
+        if request.get('close'):
+            self.sessions.pop(path, None)
+            return {'path': path, 'closed': True}
+        session = self.sessions.get(path)
+        if session is None:
+            session = self.sessions[path] = SpecSession(path)
+        start = time.time()
+        if 'text' in request:
+            # split and measured in bytes as if it was saved
+            diags = session.check(SCLCheck.split_spec_lines(request['text'].encode('utf-8'), raw=True))
+        else:
+            diags = session.check_file()
+        return {'path': path, 'diagnostics': diags.records, 'locations': diags.locations, 'reparsed': session.reparsed,
+                'rechecked': session.rechecked, 'sections': len(session.parts), 'ms': (time.time() - start) * 1000}
+
+    def serve(self):
+        '''Answer requests until the end of input'''
+        for line in iter(self.inp.readline, ''):
+            if not line.strip():
+                continue
+            request = {}
+            try:
+                request = json.loads(line)
+                response = self.handle(request)
+            except Exception as e:
+                response = {'error': '%s' % e}
+            if isinstance(request, dict) and 'id' in request:
+                response['id'] = request['id']
+            self.out.write(u'%s\n' % json.dumps(response))
+            self.out.flush()
+
+def watch(paths, interval=1.0):
+    '''Print diagnostics of given specs now and after every change, until interrupted'''
+    sessions = [SpecSession(path) for path in paths]
+    mtimes = {}
+    while True:
+        for session in sessions:
+            try:
+                mtime = os.stat(session.path).st_mtime
+            except OSError:
+                continue
+            if mtimes.get(session.path) == mtime:
+                continue
+            mtimes[session.path] = mtime
+            start = time.time()
+            diags = session.check_file()
+            diags.replay()
+            sys.stdout.write('%s checked in %.1f ms (%d of %d sections parsed), %d errors, %d warnings.\n' %
+                             (session.path, (time.time() - start) * 1000, session.reparsed, len(session.parts),
+                              diags.count('E'), diags.count('W')))
+            sys.stdout.flush()
+        time.sleep(interval)
+
+def main(argv):
+    interval = 1.0
+    server = False
+    try:
+        opts, args = getopt.getopt(argv, 'i:h', ['interval=', 'server', 'help'])
+        for o, a in opts:
+            if o in ('-i', '--interval'):
+                interval = float(a)
+            elif o == '--server':
+                server = True
+            else:
+                sys.stdout.write(__doc__ + '\n')
+                return 0
+    except (getopt.GetoptError, ValueError) as e:
+        sys.stderr.write('%s\n%s\n' % (e, __doc__))
+        return 2
+    if server:
+        Server().serve()
+        return 0
+    if not args:
+        sys.stderr.write(__doc__ + '\n')
+        return 2
+    try:
+        watch(args, interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,361 @@
+'''Micro-benchmarks of Software Collections checks
+
+Run as: python test/bench_scl.py [-s file] [-b file [-t ratio]] [benchmark ...]
+Without arguments, all benchmarks are run. Specs and file lists are generated,
+besides that only the fixtures in test/ are used.
+With -s, the results are saved to given JSON file, with -b they are compared
+against such file and the exit status is 1 if anything got slower than ratio
+times (1.5 by default) the baseline.'''
+import sys, os, getopt, glob, json, shutil, subprocess, tempfile, timeit
+# add rpmlint-scl, rpmlint and rpmlint/tools to PATH, same as test_scl.py
+for directory in ['../rpmlint/tools','../rpmlint','../tools','..']:
+    sys.path.insert(0,os.path.join(os.path.dirname(__file__),directory))
+
+import Pkg
+import SCLCheck
+import SCLPayload
+
+def timed(function, *args):
+    '''Return the best time of a call of function with args in seconds'''
+    timer = timeit.Timer(lambda: function(*args))
+    loops = 1
+    while timer.timeit(loops) < 0.2:
+        loops *= 10
+    return min(timer.repeat(3, loops)) / loops
+
+# 'label count': seconds of every reported measurement, and of the baseline
+results = {}
+baseline = {}
+# (key, ratio) of measurements slower than threshold times the baseline
+regressions = []
+threshold = 1.5
+
+def report(label, count, seconds, unit):
+    '''Print one line of a scaling curve, compared to the baseline if there is one'''
+    key = '%s %d' % (label, count)
+    results[key] = seconds
+    line = '%-32s %7d %-6s %10.3f ms %8.3f us/%s' % (label, count, unit+'s', seconds*1000, seconds*1000000/count, unit)
+    if key in baseline:
+        ratio = seconds / baseline[key]
+        line += '  x%.2f' % ratio
+        if ratio > threshold:
+            regressions.append((key, ratio))
+            line += ' SLOWER'
+    print(line)
+
+def quiet(pkg, function, *args):
+    '''Call function with args, diagnostics reported for pkg are not printed'''
+    with SCLCheck.Diagnostics(pkg):
+        function(*args)
+
+class SyntheticPackage(object):
+    '''Binary package with given files and a header describing them, nothing is on disk'''
+    def __init__(self, name, paths):
+        self.name = name
+        self.arch = None
+        self.current_linenum = None
+        self.paths = paths
+        dirnames, basenames, dirindexes, known = [], [], [], {}
+        for path in paths:
+            dirname, basename = path.rsplit('/', 1)
+            known.setdefault(dirname + '/', len(known))
+            if len(known) > len(dirnames):
+                dirnames.append(dirname + '/')
+            basenames.append(basename)
+            dirindexes.append(known[dirname + '/'])
+        self.header = {SCLCheck.rpm.RPMTAG_DIRNAMES: dirnames, SCLCheck.rpm.RPMTAG_BASENAMES: basenames,
+                       SCLCheck.rpm.RPMTAG_DIRINDEXES: dirindexes}
+
+    def files(self):
+        return dict.fromkeys(self.paths)
+
+def synthetic_files(count, scl='nodejs010', per_dir=100):
+    '''Return count paths of a SCL package, per_dir files in a directory'''
+    return ['/opt/rh/%s/root/usr/share/doc/pkg/d%d/f%d' % (scl, i // per_dir, i) for i in range(count)]
+
+def synthetic_spec(subpackages=10, requires=5, conds=5, files=10, metapackage=False):
+    '''Return lines of a SCL spec (or a SCL metapackage spec) of given size
+
+    Every subpackage has given number of Requires, %{?scl:...} blocks and
+    files in its %files section.'''
+    lines = []
+    def package(header, name, *extra):
+        lines.append(header + '\n')
+        lines.append('Summary: Synthetic package %s\n' % name)
+        lines.extend(extra)
+        for i in range(requires):
+            lines.append('Requires: %%{?scl_prefix}%s-req%d >= 1.%d\n' % (name, i, i))
+        for i in range(conds):
+            lines.append('%%{?scl:Requires: %%{scl}-runtime}\n%%{?scl:Provides: %%{?scl_prefix}%s-cap%d}\n' % (name, i))
+        lines.append('\n%%description %s\nSynthetic package %s.\n\n' % (header.split(None, 1)[1], name))
+    if metapackage:
+        lines.append('%global scl synthetic\n%scl_package %scl\n\n')
+        lines.append('Name: %scl_name\nVersion: 1\nRelease: 1%{?dist}\nSummary: Synthetic collection\n')
+        lines.append('BuildRequires: scl-utils-build\n\n%description\nSynthetic collection.\n\n')
+        package('%package runtime', 'runtime')
+        package('%package build', 'build', 'Requires: scl-utils-build\n')
+        names = ['runtime', 'build'] + ['runtime-extra%d' % i for i in range(subpackages)]
+        for name in names[2:]:
+            package('%package ' + name, name)
+        lines.append('%prep\n%setup -c -T\n\n%install\n%scl_install\n\n')
+        lines.append('%files\n\n%files runtime\n%scl_files\n\n%files build\n%{_root_sysconfdir}/rpm/macros.%{scl}-config\n\n')
+        for name in names[2:]:
+            lines.append('%%files %s\n' % name)
+            lines.extend('%%{_scl_root}/%s/file%d\n' % (name, i) for i in range(files))
+            lines.append('\n')
+    else:
+        lines.append('%{?scl:%scl_package synthetic}\n%{!?scl:%global pkg_name %{name}}\n\n')
+        lines.append('Name: %{?scl_prefix}synthetic\nVersion: 1\nRelease: 1%{?dist}\nSummary: Synthetic package\n')
+        lines.append('Source0: synthetic-%{version}.tar.gz\nBuildRequires: %{?scl_prefix}build-helper\n')
+        lines.append('%{?scl:Requires: %{scl}-runtime}\n\n%description\nSynthetic package.\n\n')
+        names = ['sub%d' % i for i in range(subpackages)]
+        package('%package -n %{?scl_prefix}synthetic-main', 'main')
+        for name in names:
+            package('%package ' + name, name)
+        lines.append('%prep\n%setup -q -n %{pkg_name}-%{version}\n\n%build\nmake\n\n%install\nmake install\n\n')
+        lines.append('%files\n%doc README\n\n')
+        for name in names:
+            lines.append('%%files %s\n' % name)
+            lines.extend('%%{_datadir}/%s/file%d\n' % (name, i) for i in range(files))
+            lines.append('\n')
+    lines.append('%changelog\n')
+    for i in range(subpackages):
+        lines.append('* Sat Oct 17 2026 Packager <packager@example.com> - 1-%d\n- Change %d\n\n' % (i, i))
+    # one line per item, as from Pkg.readlines()
+    return ''.join(lines).splitlines(True)
+
+def bench_tags():
+    '''Requires, Provides and Obsoletes extraction has to scale linearly with the number of tags'''
+    for count in [100, 1000, 10000]:
+        text = ''.join('Requires: %%{?scl_prefix}foo%d\nProvides: %%{?scl_prefix}bar%d\nObsoletes: baz%d\n' % (i, i, i)
+                       for i in range(count))
+        report('get_requires', count, timed(SCLCheck.check.get_requires, text), 'tag')
+        report('get_provides', count, timed(SCLCheck.check.get_provides, text), 'tag')
+        report('get_obsoletes_and_conflicts', count, timed(SCLCheck.check.get_obsoletes_and_conflicts, text), 'tag')
+
+def bench_conditionals():
+    '''Finding %{?scl:...} blocks has to scale linearly with the number of blocks'''
+    for count in [100, 1000, 10000]:
+        text = ''.join('%%{?scl:Requires: %%{scl}-runtime}\nRequires: foo%d\n%%{?scl:%%{?scl_prefix:\n%%{name}}}\n' % i
+                       for i in range(count))
+        report('remove_scl_conds', count, timed(SCLCheck.check.remove_scl_conds, text), 'block')
+        conds = SCLCheck.SCLConditionals(text)
+        report('SCLConditionals.inside (%d blocks)' % count, 1, timed(conds.inside, len(text) // 2), 'lookup')
+
+def bench_srpm():
+    '''Reading the spec from the payload versus extracting whole source RPMs
+    Set SCLBENCH_SRPMS to a glob of (large) source RPMs, test/source is used by default'''
+    pattern = os.environ.get('SCLBENCH_SRPMS', os.path.join(os.path.dirname(__file__), 'source', '*.src.rpm'))
+    for path in sorted(glob.glob(pattern)):
+        pkg = Pkg.Pkg(path, tempfile.gettempdir())
+        compressor = SCLCheck.header_text(pkg.header[SCLCheck.rpm.RPMTAG_PAYLOADCOMPRESSOR])
+        spec = [f for f in pkg.header[SCLCheck.rpm.RPMTAG_BASENAMES] if SCLCheck.header_text(f).endswith('.spec')][0]
+        def extract():
+            tmp = tempfile.mkdtemp()
+            try:
+                extracted = Pkg.Pkg(path, tmp)
+                [f.path for f in extracted.files().values()]
+                extracted.cleanup()
+            finally:
+                shutil.rmtree(tmp)
+        size = os.path.getsize(path)
+        report('payload %s' % os.path.basename(path), size, timed(SCLPayload.read_payload_member, path, compressor, spec), 'byte')
+        report('extract %s' % os.path.basename(path), size, timed(extract), 'byte')
+
+def bench_binary():
+    '''check_binary reading the header versus the list of all paths, with peak memory where tracemalloc is available'''
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    for count in [1000, 10000, 100000, 200000]:
+        pkg = SyntheticPackage('nodejs010-foo-doc', synthetic_files(count))
+        for label in ['header', 'files']:
+            report('check_binary (%s)' % label, count, timed(SCLCheck.check.check_binary, pkg), 'file')
+            if tracemalloc:
+                tracemalloc.start()
+                SCLCheck.check.check_binary(pkg)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print('%-32s %7d %-6s %10.3f MB' % ('check_binary peak (%s)' % label, count, 'files', peak / 1e6))
+            pkg.header = None
+
+def bench_path_policy():
+    '''Classifying a directory has to cost the same no matter how many path rules there are'''
+    dirname = '/opt/rh/nodejs010/root/usr/share/doc/pkg/'
+    for count in [10, 100, 1000, 10000]:
+        rules = SCLCheck.default_path_policy + [('/usr/share/rule%d/' % i, 'allowed') for i in range(count)]
+        policy = SCLCheck.PathPolicy(rules)
+        report('PathPolicy.directory (%d rules)' % len(rules), 1, timed(policy.directory, dirname, 'nodejs010'), 'lookup')
+
+def bench_spec():
+    '''check_spec, SpecModel and both spec checks have to scale linearly with the number of subpackages'''
+    pkg = SyntheticPackage('synthetic.spec', [])
+    for count in [10, 100, 1000]:
+        for label, lines, check in [('scl', synthetic_spec(count), SCLCheck.check.check_scl_spec),
+                                    ('metapackage', synthetic_spec(count, metapackage=True), SCLCheck.check.check_metapackage)]:
+            report('check_spec (%s)' % label, count, timed(quiet, pkg, SCLCheck.check.check_spec, pkg, pkg.name, lines), 'subpkg')
+            report('SpecModel (%s)' % label, count, timed(SCLCheck.SpecModel, lines), 'subpkg')
+            model = SCLCheck.SpecModel(lines)
+            report('%s' % check.__name__, count, timed(quiet, pkg, check, pkg, model), 'subpkg')
+
+def bench_helpers():
+    '''Helpers of the checks on a synthetic spec of growing size'''
+    for count in [10, 100, 1000]:
+        lines = synthetic_spec(count)
+        text = ''.join(lines)
+        model = SCLCheck.SpecModel(lines)
+        report('get_build_requires', count, timed(SCLCheck.check.get_build_requires, text), 'subpkg')
+        report('get_name', count, timed(SCLCheck.check.get_name, text), 'subpkg')
+        # the spec is parsed once, then its model is remembered
+        report('get_files', count, timed(SCLCheck.check.get_files, text, 'sub%d' % (count - 1)), 'subpkg')
+        report('get_tags', count, timed(SCLCheck.check.get_tags, model, 'Requires', 'Provides'), 'subpkg')
+        report('SpecModel.file_lines', count, timed(model.file_lines, 'sub%d' % (count - 1)), 'subpkg')
+        report('SpecModel.calls_of', count, timed(model.calls_of, 'scl_package', '?scl'), 'subpkg')
+        # the section index is built on first use, then lookups do not depend on the size
+        report('SpecModel.find_section', count, timed(model.find_section, 'files', 'sub%d' % (count - 1)), 'subpkg')
+        report('SpecModel.package_at', count, timed(model.package_at, len(model.text) // 2), 'subpkg')
+        report('MacroExpander', count, timed(SCLCheck.MacroExpander, model), 'subpkg')
+        report('SpecModel.expand (memoised)', count, timed(model.expand, '%{name}-sub0 = %{version}'), 'subpkg')
+        report('SpecModel.conditionals', count, timed(SCLCheck.SCLConditionals, model.text), 'subpkg')
+
+def bench_watch():
+    '''Checking an edited spec again, only the edited section is parsed'''
+    import SCLWatch
+    for count in [10, 100, 1000]:
+        lines = synthetic_spec(count)
+        edited = [lines, [line.replace('/sub0/file0', '/sub0/renamed0') for line in lines]]
+        session = SCLWatch.SpecSession('synthetic.spec')
+        def recheck():
+            edited.reverse()
+            session.check(edited[0])
+        report('SpecSession.check (1 %files edited)', count, timed(recheck), 'subpkg')
+
+def bench_import():
+    '''Import of the plugin in a fresh interpreter, best of 20, rpmlint modules it needs are imported before'''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(os.path.abspath(p) for p in sys.path))
+    # as installed, with byte code compiled in advance
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = ('import rpm, Filter, AbstractCheck, Config, Pkg, time\n'
+            't = time.time()\nimport SCLCheck\nprint(time.time() - t)')
+    # not in the current directory, it is first in sys.path
+    cwd = tempfile.gettempdir()
+    times = [float(subprocess.check_output([sys.executable, '-c', code], env=env, cwd=cwd)) for i in range(21)]
+    report('import SCLCheck', 1, min(times[1:]), 'import')
+
+def bench_index():
+    '''Collection-wide index: building it and finding all packages not reaching the runtime'''
+    import random, SCLIndex
+    random.seed(0)
+    for count in [1000, 5000, 20000]:
+        # every package requires a few earlier ones, some only their provides
+        entries = [('c-runtime', ['c-runtime', 'c-p0', 'c-p0(api)'], ['scl-utils'], True)]
+        for i in range(1, count):
+            requires = ['c-p%d' % random.randrange(i) for r in range(3)] + ['c-p%d(api)' % random.randrange(i), 'libc.so.6']
+            entries.append(('c-p%d' % i, ['c-p%d' % i, 'c-p%d(api)' % i], requires, True))
+        def build():
+            index = SCLIndex.DependencyIndex()
+            index.add('collection', entries)
+            index.finish()
+            return index
+        report('DependencyIndex.finish', count, timed(build), 'pkg')
+        report('DependencyIndex.problems', count, timed(lambda: list(build().problems())), 'pkg')
+
+def bench_large_spec():
+    '''check_spec reading a spec file with a huge %changelog from disk, with peak memory where tracemalloc is available'''
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    pkg = SyntheticPackage('synthetic.spec', [])
+    tmp = tempfile.mkdtemp()
+    try:
+        for count in [10000, 100000, 1000000]:
+            path = os.path.join(tmp, 'synthetic.spec')
+            with open(path, 'w') as spec:
+                spec.writelines(synthetic_spec(100))
+                for i in range(count):
+                    spec.write('* Sat Oct 17 2026 Packager <packager@example.com> - 1-%d\n- Change %d\n\n' % (i, i))
+            report('check_spec (%changelog lines)', count * 3, timed(quiet, pkg, SCLCheck.check.check_spec, pkg, path), 'line')
+            if tracemalloc:
+                tracemalloc.start()
+                quiet(pkg, SCLCheck.check.check_spec, pkg, path)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print('%-32s %7d %-6s %10.3f MB (file has %.3f MB)' % ('check_spec peak memory', count * 3, 'lines',
+                                                                   peak / 1e6, os.path.getsize(path) / 1e6))
+    finally:
+        shutil.rmtree(tmp)
+
+def bench_fixtures():
+    '''check_spec on all spec files in test/spec'''
+    # SpecCheck.spec links to rpmlint checkout, which may be missing
+    paths = [p for p in sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'spec', '*.spec'))) if os.path.exists(p)]
+    specs = [(Pkg.FakePkg(path), path, list(Pkg.readlines(path))) for path in paths]
+    def check_all():
+        for pkg, path, lines in specs:
+            quiet(pkg, SCLCheck.check.check_spec, pkg, path, lines)
+    report('check_spec (test/spec)', len(specs), timed(check_all), 'spec')
+
+def bench_async():
+    '''SCLAsync pipeline checking specs whose every read takes 5 ms, serial versus reading ahead'''
+    if sys.version_info < (3, 6):
+        print('needs Python 3.6')
+        return
+    import asyncio, time
+    import SCLAsync
+    paths = [p for p in sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'spec', '*.spec'))) if os.path.exists(p)] * 5
+    def slow_read(path):
+        time.sleep(0.005)
+        return SCLAsync.read(path)
+    def check_all(readers, prefetch):
+        items = SCLAsync.pipeline(paths, readers=readers, prefetch=prefetch, read=slow_read)
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                try:
+                    loop.run_until_complete(items.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.close()
+    for readers, prefetch in [(1, 1), (4, 8), (16, 32)]:
+        report('pipeline (%d readers, prefetch %d)' % (readers, prefetch), len(paths), timed(check_all, readers, prefetch), 'spec')
+
+benchmarks = [(n[6:], f) for n, f in sorted(globals().items()) if n.startswith('bench_')]
+
+def main(argv):
+    global threshold
+    save = None
+    try:
+        opts, args = getopt.getopt(argv, 's:b:t:h')
+        for o, a in opts:
+            if o == '-s':
+                save = a
+            elif o == '-b':
+                with open(a) as f:
+                    baseline.update(json.load(f))
+            elif o == '-t':
+                threshold = float(a)
+            else:
+                print(__doc__)
+                return 0
+    except (getopt.GetoptError, ValueError, IOError) as e:
+        sys.stderr.write('%s\n%s\n' % (e, __doc__))
+        return 2
+    for bname, function in benchmarks:
+        if args and bname not in args:
+            continue
+        print('== %s: %s' % (bname, function.__doc__))
+        function()
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if baseline:
+        print('== %d of %d measurements slower than x%.2f the baseline' % (len(regressions), len(results), threshold))
+        for key, ratio in regressions:
+            print('%-48s x%.2f' % (key, ratio))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
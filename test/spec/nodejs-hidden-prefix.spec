@@ -0,0 +1,61 @@
+%{?scl:%scl_package nodejs}
+%{!?scl:%global pkg_name %{name}}
+%global pfx %{?scl_prefix}
+%global runtime_dep %{?scl:%scl_runtime}%{!?scl:nodejs-filesystem}
+
+Name: %{pfx}nodejs
+Version: 0.10.3
+Release: 3%{?dist}
+Summary: JavaScript runtime
+License: MIT and ASL 2.0 and ISC and BSD
+Group: Development/Languages
+URL: http://nodejs.org/
+
+Source0: http://nodejs.org/dist/v%{version}/node-v%{version}.tar.gz
+
+BuildRequires: %{pfx}v8-devel
+Requires: %{runtime_dep}
+Provides: %{pfx}nodejs(engine) = %{version}
+Provides: %{name}(abi) = 0.10
+Conflicts: %{pfx}node <= 0.3.2-11
+
+%description
+Node.js is a platform built on Chrome's JavaScript runtime.
+
+%package -n %{pfx}nodejs-devel
+Summary: JavaScript runtime - development headers
+Group: Development/Languages
+Requires: %{pfx}nodejs = %{version}-%{release}
+
+%description -n %{pfx}nodejs-devel
+Development headers for the Node.js JavaScript runtime.
+
+%package docs
+Summary: Node.js API documentation
+Group: Documentation
+BuildArch: noarch
+
+%description docs
+The API documentation for the Node.js JavaScript runtime.
+
+%prep
+%setup -q -n node-v%{version}
+
+%build
+make %{?_smp_mflags}
+
+%install
+make install DESTDIR=%{buildroot}
+
+%files
+%{_bindir}/node
+
+%files -n %{pfx}nodejs-devel
+%{_includedir}/node
+
+%files docs
+%{_defaultdocdir}/%{name}-docs-%{version}
+
+%changelog
+* Tue Apr 09 2013 Stephen Gallagher <sgallagh@redhat.com> - 0.10.3-3
+- Hide the SCL prefix behind local macros
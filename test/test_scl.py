@@ -1,4 +1,5 @@
-import sys, os
+import sys, os, tempfile, shutil, io, json, threading, time, multiprocessing
+import pytest
 # add rpmlint-scl, rpmlint and rpmlint/tools to PATH
 # also add rpmlint-scl/tools, so this keeps working once merged with rpmlint
 for directory in ['../rpmlint/tools','../rpmlint','../tools','..']:
@@ -9,7 +10,20 @@ os.environ['TESTPATH'] = os.path.dirname(__file__)
 
 
 import Testing
+import Config
+import Pkg
 import SCLCheck
+import SCLBatch
+import SCLCache
+import SCLWatch
+import SCLIndex
+import SCLSink
+import SCLPayload
+import SCLStats
+if sys.version_info >= (3, 6):
+    # uses asyncio and async generators
+    import asyncio
+    import SCLAsync
 
 class Tools(object):
     '''Class providing basic tools for other classes'''
@@ -151,6 +165,10 @@ class TestSCLSource(Tools):
         assert len(out) == 1
         assert 'provides-without-scl-prefix' in out[0]
     
+    def test_nonscl_tags(self):
+        '''Tests SCL spec with nonprefixed Provides, Obsoletes and Conflicts used only without SCL'''
+        assert not self._spec_test_output('spec/nodejs-nonscl-tags')
+    
     def test_main_package_without_scl_require(self):
         '''Tests SCL spec where the main package doesn't require anything from collection'''
         out = self._spec_test_output('spec/nodejs-norequire')
@@ -169,6 +187,10 @@ class TestSCLSource(Tools):
         assert len(out) == 1
         assert 'scl-setup-without-n' in out[0]
 
+    def test_prefix_hidden_behind_macros(self):
+        '''Tests SCL spec with the SCL prefix and runtime in its own macros'''
+        assert not self._spec_test_output('spec/nodejs-hidden-prefix')
+
 class TestSCLBinary(Tools):
     '''Tests of Software Collections binary RPMs'''
     def test_scl_name_screwed_up(self):
@@ -188,3 +210,555 @@ class TestSCLBinary(Tools):
         out = self._rpm_test_output('binary/macros-nodejs010-nodejs-oauth')
         assert len(out) == 1
         assert 'scl-rpm-macros-outside-of-build' in out[0]
+
+    def test_file_table(self):
+        '''Tests the file table from header describes the same files as pkg.files()'''
+        pkg = Testing.getTestedPackage('binary/nodejs010-runtime')
+        dirnames, basenames, dirindexes = SCLCheck.file_table(pkg)
+        assert len(dirnames) < len(basenames)
+        assert [dirnames[i] + b for b, i in zip(basenames, dirindexes)] == list(pkg.files().keys())
+        pkg.header = None
+        table = SCLCheck.file_table(pkg)
+        assert [table.path(i) for i in range(len(table))] == list(pkg.files().keys())
+        assert table.basenames == basenames
+        assert list(table.files_in(set([0]))) == [i for i, d in enumerate(table.dirindexes) if d == 0]
+
+    def test_path_policy_option(self):
+        '''Tests SCLPathPolicy option allows more directories'''
+        Config.setOption('SCLPathPolicy', [('/usr/share/foo/', 'allowed')])
+        try:
+            assert not self._rpm_test_output('binary/outside-nodejs010-nodejs-oauth')
+        finally:
+            Config.setOption('SCLPathPolicy', [])
+        assert self._rpm_test_output('binary/outside-nodejs010-nodejs-oauth')
+
+    def test_path_policy(self):
+        '''Tests the prefix trie of path rules'''
+        policy = SCLCheck.PathPolicy(SCLCheck.default_path_policy + [('/opt/rh/common/', 'allowed')])
+        assert policy.directory('/opt/rh/nodejs010/root/usr/', 'nodejs010')[0] == 'scl'
+        assert policy.directory('/opt/rh/common/', 'nodejs010')[0] == 'allowed'
+        assert policy.directory('/opt/rh/python33/', 'nodejs010')[0] == 'bad'
+        assert policy.directory('/etc/cron.daily/', 'nodejs010')[0] is None
+        action, nodes = policy.directory('/etc/scl/prefixes/', 'nodejs010')
+        assert action is None
+        assert policy.file(nodes, 'nodejs010', 'nodejs010') == 'runtime'
+        assert policy.file(nodes, 'python33', 'nodejs010') is None
+
+class TestSCLSpecModel(object):
+    '''Tests of the structured spec model'''
+    def _model(self, spec):
+        '''Build the model of a spec from the test directory'''
+        return SCLCheck.SpecModel(Pkg.readlines(os.path.join(os.environ['TESTPATH'], spec + '.spec')))
+
+    def test_packages(self):
+        '''Tests packages and their preamble tags are recognized'''
+        spec = self._model('spec/nodejs-good')
+        assert [p.args for p in spec.packages] == [None, 'devel', 'docs']
+        assert spec.packages[0].get('Name') == ['%{?scl_prefix}nodejs']
+        assert '%{scl}-runtime' in spec.packages[0].get('Requires')
+        assert spec.packages[1].get('Requires')[0] == '%{name} = %{version}-%{release}'
+        assert not spec.packages[2].get('Requires')
+
+    def test_sections(self):
+        '''Tests section spans and macro use sites'''
+        spec = self._model('spec/nodejs010')
+        start, end = spec.section('install')
+        assert spec.text[start:end].startswith('%install')
+        assert spec.calls_of('scl_install', None, start, end)
+        assert spec.section_lines('files', 'runtime') == ['%scl_files']
+        assert spec.defines('scl', 'nodejs010')
+        assert spec.uses_macro('scl')
+
+    def test_section_index(self):
+        '''Tests sections are indexed with their package, line numbers and byte offsets'''
+        path = os.path.join(os.environ['TESTPATH'], 'spec/nodejs010.spec')
+        with open(path, 'rb') as f:
+            data = f.read()
+        spec = self._model('spec/nodejs010')
+        index = spec.section_index()
+        assert [s.name for s in index if s.package == 'runtime'] == ['package', 'description', 'files']
+        for section in index:
+            header = data[section.start_byte:section.end_byte].split(b'\n')[0]
+            assert header == data.split(b'\n')[section.line - 1]
+            assert header.startswith(b'%' + section.name.encode('utf-8'))
+        assert index[-1].end_byte == len(data) and index[-1].name == 'changelog'
+        assert spec.find_section('files', 'build').package == 'build'
+        assert spec.package('runtime').args == 'runtime' and spec.package('missing') is None
+        assert spec.package_at(spec.find_section('description', 'build').start + 20) == 'build'
+        assert SCLCheck.section_package('post', '-p /sbin/ldconfig -n %{?scl_prefix}foo') == '-n %{?scl_prefix}foo'
+
+    def test_files_index(self):
+        '''Tests %files sections are found by package, with -f, -n and scriptlets after them'''
+        text = ('Name: foo\n%package -n bar\nSummary: bar\n%package runtime\nSummary: runtime\n'
+                '%files -f foo.lang\n%doc README\n%files -n bar\n/usr/bin/bar\n'
+                '%files runtime -f runtime.list\n%scl_files\n%post runtime\n/sbin/ldconfig\n%changelog\n')
+        spec = SCLCheck.SpecModel(text.splitlines(True))
+        assert spec.files_index()['runtime'][2] == ['runtime.list']
+        assert spec.file_lines() == ['%doc README']
+        assert spec.file_lines('-n bar') == ['/usr/bin/bar']
+        assert spec.file_lines('runtime') == ['%scl_files']
+        assert spec.file_lines('docs') == []
+        assert SCLCheck.check.get_files(text, 'bar') == ['/usr/bin/bar']
+        assert SCLCheck.check.get_files(text, 'runtime') == ['%scl_files']
+
+    def test_macro_expansion(self):
+        '''Tests macros are expanded as in a SCL build'''
+        text = ('%{?scl:%scl_package foo}\n%global pfx %{?scl_prefix}\n%{!?scl:%global pfx none-}\n'
+                '%define loop %{loop}x\nName: %{pfx}foo\n')
+        spec = SCLCheck.SpecModel(text.splitlines(True))
+        scl = SCLCheck.MacroExpander.SCL_STANDIN
+        assert spec.expand('%{name}') == scl + '-foo'
+        assert spec.expand('%name-%{?scl:yes}%{!?scl:no}-%{?undefined}') == scl + '-foo-yes-'
+        assert spec.expand('%{pkg_name} %_scl_root %%{pfx}') == 'foo /opt/rh/%s/root %%{pfx}' % scl
+        assert spec.expand('%{_datadir} %{expand:%pfx} %{loop}') == '%{_datadir} %{expand:%pfx} %{loop}x'
+
+    def test_streamed_lines(self):
+        '''Tests spec is read line by line and %changelog is only kept where it uses macros'''
+        path = os.path.join(os.environ['TESTPATH'], 'spec/nodejs-good.spec')
+        assert list(SCLCheck.read_spec_lines(path)) == list(Pkg.readlines(path))
+        with open(path, 'rb') as spec:
+            assert list(SCLCheck.split_spec_lines(spec.read())) == list(Pkg.readlines(path))
+        text = 'Name: foo\n%files\n/foo\n%changelog\n* Sat Oct 17 2026 Someone\n- Fixed %{scl_prefix}\n%post\nfoo\n'
+        spec = SCLCheck.SpecModel(iter(text.splitlines(True)))
+        assert 'Someone' not in spec.text and '%{scl_prefix}' in spec.text
+        assert spec.section_lines('changelog') == ['- Fixed %{scl_prefix}']
+        assert spec.section_lines('post') == ['foo']
+        assert spec.file_lines() == ['/foo']
+        raw = SCLCheck.SpecModel(SCLCheck.split_spec_lines(text.encode('utf-8'), raw=True))
+        assert raw.text == spec.text and raw.size == len(text)
+
+    def test_raw_lines_offsets(self):
+        '''Byte offsets come from the raw lines, also in specs that are not UTF-8'''
+        data = u'Name: foo\nSummary: caf\xe9 caf\xe9\nProvides: bar\n'.encode('iso8859-1')
+        spec = SCLCheck.SpecModel(SCLCheck.split_spec_lines(data, raw=True))
+        location = spec.location(spec.packages[0].find('Provides')[0][1])
+        assert (location.line, location.start) == (3, data.index(b'Provides'))
+        assert spec.size == len(data)
+
+class TestSCLHelpers(Tools):
+    '''Tests of helpers other plugins may reuse'''
+    def test_lazy_regex(self):
+        '''Tests regex is compiled on first use and replaces itself in module globals'''
+        SCLCheck.lazy_test_regex = SCLCheck.LazyRegex(r'^a+$')
+        try:
+            assert SCLCheck.lazy_test_regex.match('aaa')
+            assert isinstance(SCLCheck.lazy_test_regex, type(SCLCheck.re.compile('')))
+        finally:
+            del SCLCheck.lazy_test_regex
+
+    def test_spec_directive(self):
+        '''Tests one match of a line starting with % finds the same as the separate regexes'''
+        for line in ['%files -n %{?scl_prefix}foo', '%packagefoo', '%{?scl:Requires: %{scl}-runtime}', '%define a',
+                     '%global pkg_name %{name}', '%define f(x) %{x}', '%{setup} -q', '%{setup}x', '%%{name}']:
+            directive = SCLCheck.spec_directive.match(line)
+            groups = directive.groupdict() if directive else {}
+            section = SCLCheck.spec_section.match(line)
+            assert groups.get('section') == (section and section.group(1))
+            definition = not section and SCLCheck.spec_definition.match(line)
+            assert groups.get('definition') == (definition and definition.group(2) or None)
+            call = not section and not definition and not groups.get('condition') and SCLCheck.spec_call.match(line)
+            assert groups.get('call') == (call and call.group(1) or None)
+        assert SCLCheck.scl_require.match('%{?scl_prefix}foo') and SCLCheck.scl_require.match('%{scl}-runtime')
+        assert not SCLCheck.scl_require.match('foo %{name}')
+
+    def test_tag_iterators(self):
+        '''Tests tag iterators return spans within the given part of the buffer'''
+        text = 'Requires: foo\nProvides: bar\n%package baz\nRequires: baz\n%{?scl:Requires: %{scl}-runtime}\n'
+        assert SCLCheck.span_values(text, SCLCheck.iter_requires(text)) == ['foo', 'baz', '%{scl}-runtime}']
+        start = text.index('%package')
+        assert SCLCheck.span_values(text, SCLCheck.iter_requires(text, start)) == ['baz', '%{scl}-runtime}']
+        assert SCLCheck.span_values(text, SCLCheck.iter_requires(text, 0, start)) == ['foo']
+        assert list(SCLCheck.iter_provides(text)) == [(24, 27)]
+        assert not list(SCLCheck.iter_obsoletes_and_conflicts(text))
+
+    def test_scl_conditionals(self):
+        '''Tests spans of nested, multi line and %if SCL conditionals'''
+        text = 'a\n%if 0%{?scl}\nX\n%else\nY\n%endif\n%{!?scl:Z}\n%{?scl:%{b}\nW}\nQ'
+        conds = SCLCheck.SCLConditionals(text)
+        assert conds.strip() == 'a\n%if 0%{?scl}\n%else\nY\n%endif\n%{!?scl:Z}\n\nQ'
+        assert conds.strip(True) == 'a\n%if 0%{?scl}\nX\n%else\n%endif\n\n%{?scl:%{b}\nW}\nQ'
+        assert conds.inside(text.index('X')) and conds.inside(text.index('W'))
+        assert not conds.inside(text.index('Y')) and conds.inside(text.index('Y'), True)
+        assert conds.inside(text.index('Z'), True) and not conds.inside(text.index('Z'))
+        assert not conds.inside(text.index('Q')) and not conds.inside(text.index('Q'), True)
+        assert SCLCheck.check.remove_scl_conds('x%{?scl:{%{?scl:y}}}z%{?scl:') == 'xz'
+
+    def test_spec_from_payload(self):
+        '''Tests spec file is read from the source RPM payload without extracting it'''
+        srpm = os.path.join(os.environ['TESTPATH'], 'source/nodejs010-nodejs-forever-agent-0.2.0-2.el6_4.src.rpm')
+        data = SCLPayload.read_payload_member(srpm, 'gzip', 'nodejs-forever-agent.spec')
+        assert data.startswith(b'%{?scl:%scl_package nodejs-forever-agent}')
+        assert SCLPayload.read_payload_member(srpm, 'gzip', 'missing.spec') is None
+        assert SCLPayload.read_payload_member(srpm, 'zstd', 'nodejs-forever-agent.spec') is None
+        # a payload that is not what the header says
+        for compressor in ('xz', 'lzma', 'bzip2'):
+            assert SCLPayload.read_payload_member(srpm, compressor, 'nodejs-forever-agent.spec') is None
+        pkg = Testing.getTestedSpecPackage('spec/nodejs-norequire')
+        Testing.startTest()
+        with open(pkg.name, 'rb') as spec:
+            SCLCheck.check.check_spec(pkg, pkg.name, SCLCheck.split_spec_lines(spec.read()))
+        assert Testing.getOutput() == self._spec_test_output('spec/nodejs-norequire')
+
+class TestSCLBatch(Tools):
+    '''Tests of checking many packages at once'''
+    specs = ['spec/nodejs010-badfiles', 'spec/nodejs-good', 'spec/nodejs-norequire', 'spec/nodejs010-missing-requires']
+
+    def test_diagnostics_are_collected(self):
+        '''Diagnostics collected from a check are replayed unchanged'''
+        expected = self._spec_test_output('spec/nodejs010-badfiles')
+        pkg = Testing.getTestedSpecPackage('spec/nodejs010-badfiles')
+        Testing.startTest()
+        with SCLCheck.Diagnostics(pkg) as diags:
+            SCLCheck.check.check_spec(pkg, pkg.name)
+        assert not Testing.getOutput()
+        assert diags.count('E') == 2 and diags.count('W') == 1
+        diags.replay()
+        assert Testing.getOutput() == expected
+
+    def test_pool_keeps_order(self):
+        '''Process pool output equals serial output in input order'''
+        expected = []
+        for spec in self.specs:
+            expected.extend(self._spec_test_output(spec))
+        paths = [os.path.join(os.environ['TESTPATH'], spec + '.spec') for spec in self.specs]
+        Testing.startTest()
+        assert SCLBatch.run(paths, 2, out=open(os.devnull, 'w')) == 4
+        assert Testing.getOutput() == expected
+
+    def test_threads_stress(self):
+        '''Many packages checked by many threads at once give the serial output'''
+        expected = []
+        for spec in self.specs * 25:
+            expected.extend(self._spec_test_output(spec))
+        paths = [os.path.join(os.environ['TESTPATH'], spec + '.spec') for spec in self.specs * 25]
+        Testing.startTest()
+        assert SCLBatch.run(paths, 16, out=open(os.devnull, 'w'), threads=True) == 4 * 25
+        assert Testing.getOutput() == expected
+
+class TestSCLCache(Tools):
+    '''Tests of the persistent result cache'''
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay(self):
+        '''Cached diagnostics are replayed instead of checking the spec again'''
+        spec = os.path.join(os.environ['TESTPATH'], 'spec/nodejs010-badfiles.spec')
+        expected = self._spec_test_output('spec/nodejs010-badfiles')
+        cache = SCLCache.SCLCache(os.path.join(self.tmpdir, 'cache.db'))
+        pkg = Testing.getTestedSpecPackage('spec/nodejs010-badfiles')
+        assert cache.get(SCLCache.spec_key(spec), pkg) is None
+        with SCLCheck.Diagnostics(pkg) as diags:
+            SCLCheck.check.check_spec(pkg, spec)
+        cache.put(SCLCache.spec_key(spec), diags)
+        # a new object, as in the next run
+        cache = SCLCache.SCLCache(cache.path)
+        Testing.startTest()
+        cached = cache.get(SCLCache.spec_key(spec), pkg)
+        cached.replay()
+        assert Testing.getOutput() == expected
+        assert cached.locations == diags.locations
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (1, 0, 1)
+
+    def test_lru_eviction(self):
+        '''Least recently used entries are evicted when the cache is full'''
+        cache = SCLCache.SCLCache(os.path.join(self.tmpdir, 'cache.db'), 300)
+        pkg = Testing.getTestedSpecPackage('spec/nodejs010-badfiles')
+        diags = SCLCheck.Diagnostics(pkg)
+        diags.records = [('E', 'some-error', ('x' * 50,))]
+        for i in range(10):
+            cache.put('spec:%d' % i, diags)
+            cache.get('spec:0', pkg)
+        assert cache.stats()['size'] <= 300
+        assert cache.get('spec:0', pkg) is not None
+        assert cache.get('spec:1', pkg) is None
+        assert cache.get('spec:9', pkg) is not None
+        # replacing an entry keeps the running total right, also for a new object
+        cache.put('spec:9', diags)
+        cache = SCLCache.SCLCache(cache.path, 300)
+        assert cache.stats()['size'] == cache._db().execute('SELECT SUM(size) FROM results').fetchone()[0]
+
+class TestSCLWatch(Tools):
+    '''Tests of incremental checks of edited specs'''
+    def _lines(self, spec):
+        return list(Pkg.readlines(os.path.join(os.environ['TESTPATH'], spec + '.spec')))
+
+    def test_join_equals_whole_parse(self):
+        '''SpecModel joined from separately parsed sections equals the one parsed at once'''
+        for spec in TestSCLBatch.specs + ['spec/nodejs010']:
+            lines = self._lines(spec)
+            whole = SCLCheck.SpecModel(lines)
+            joined = SCLCheck.SpecModel.join([SCLCheck.SpecModel(part) for part in SCLCheck.split_sections(lines)])
+            for attr in ('text', 'sections', 'definitions', 'calls', 'macros'):
+                assert getattr(joined, attr) == getattr(whole, attr)
+            assert [(p.args, p.start, p.tags, p.conditions) for p in joined.packages] == [(p.args, p.start, p.tags, p.conditions) for p in whole.packages]
+
+    def test_only_changed_section_is_parsed(self):
+        '''After an edit of %files, only that section is parsed and the result equals a full check'''
+        lines = self._lines('spec/nodejs010')
+        session = SCLWatch.SpecSession('nodejs010.spec')
+        assert session.check(lines).records == []
+        assert session.reparsed == len(SCLCheck.split_sections(lines))
+        edited = [line.replace('%scl_files', '%{_datadir}/foo') for line in lines]
+        records = session.check(edited).records
+        assert session.reparsed == 1
+        pkg = Pkg.FakePkg('nodejs010.spec')
+        with SCLCheck.Diagnostics(pkg) as diags:
+            SCLCheck.check.check_spec(pkg, pkg.name, edited)
+        assert records == diags.records == [('E', 'scl-runtime-package-without-%scl_files', ())]
+        session.check(edited)
+        assert session.reparsed == 0
+
+    def test_unchanged_inputs_are_not_checked(self):
+        '''An edit of %description keeps the diagnostics, moved down by the inserted line'''
+        lines = self._lines('spec/nodejs-n-noprefix')
+        session = SCLWatch.SpecSession('nodejs-n-noprefix.spec')
+        before = session.check(lines)
+        edited = list(lines)
+        edited.insert(lines.index('%description\n') + 1, u'\u017elu\u0165ou\u010dk\u00fd k\u016f\u0148\n')
+        after = session.check(edited)
+        assert (session.reparsed, session.rechecked) == (1, False)
+        pkg = Pkg.FakePkg('nodejs-n-noprefix.spec')
+        with SCLCheck.Diagnostics(pkg) as diags:
+            SCLCheck.check.check_spec(pkg, pkg.name, edited)
+        assert after.records == before.records == diags.records == [('E', 'subpackage-with-n-without-scl-prefix', ())]
+        assert after.locations == diags.locations
+        assert after.locations[0].line == before.locations[0].line + 1
+        assert after.locations[0].start == before.locations[0].start + len(edited[lines.index('%description\n') + 1].encode('utf-8'))
+        # a change of what the checks look at is checked again
+        session.check([line.replace('%setup -q -n', '%setup -q') for line in edited])
+        assert (session.reparsed, session.rechecked) == (1, True)
+
+    def test_server(self):
+        '''JSON requests get JSON responses with the diagnostics'''
+        path = os.path.join(os.environ['TESTPATH'], 'spec/nodejs010-badfiles.spec')
+        text = ''.join(self._lines('spec/nodejs010-badfiles'))
+        requests = [{'id': 1, 'path': path}, {'id': 2, 'path': path, 'text': text}, {'id': 3, 'path': path, 'close': True}]
+        out = io.StringIO()
+        SCLWatch.Server(io.StringIO(u''.join(json.dumps(r) + u'\n' for r in requests) + u'not json\n'), out).serve()
+        responses = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [r.get('id') for r in responses] == [1, 2, 3, None]
+        assert len(responses[0]['diagnostics']) == 3
+        assert [l[0] for l in responses[0]['locations']] == ['', 'runtime', 'build']
+        assert responses[1]['diagnostics'] == responses[0]['diagnostics'] and responses[1]['reparsed'] == 0
+        assert responses[2]['closed'] and 'error' in responses[3]
+
+class TestSCLStats(Tools):
+    '''Tests of the timing and counter instrumentation'''
+    def teardown_method(self, method):
+        SCLCheck.disable_stats()
+
+    def test_stats_are_recorded(self):
+        '''Enabled stats count calls and regex searches of the checks, output stays the same'''
+        expected = self._spec_test_output('spec/nodejs010-badfiles')
+        stats = SCLCheck.enable_stats()
+        assert SCLStats.stats is stats and isinstance(SCLCheck.scl_prefix, SCLStats.CountingRegex)
+        assert self._spec_test_output('spec/nodejs010-badfiles') == expected
+        methods = stats.methods()
+        assert methods['check_spec']['calls'] == 1
+        assert methods['SpecModel']['regex_calls'] > 0
+        # nested calls are included in the caller
+        assert methods['check_spec']['regex_calls'] >= methods['SpecModel']['regex_calls'] + methods['check_metapackage']['regex_calls']
+        assert [name for name, seconds in stats.slowest()] == [Testing.getTestedSpecPackage('spec/nodejs010-badfiles').name]
+        assert 'sclcheck_calls_total{method="check_spec"} 1\n' in stats.to_prometheus()
+        SCLCheck.disable_stats()
+        assert isinstance(SCLCheck.scl_prefix, type(SCLCheck.re.compile('')))
+
+    def test_batch_merges_stats(self):
+        '''Stats recorded in pool processes are merged in the main one, whatever their start method'''
+        paths = [os.path.join(os.environ['TESTPATH'], spec + '.spec') for spec in TestSCLBatch.specs]
+        methods = [None]
+        if hasattr(multiprocessing, 'get_all_start_methods'):
+            methods = multiprocessing.get_all_start_methods()
+            default = multiprocessing.get_start_method()
+        try:
+            for method in methods:
+                if method:
+                    multiprocessing.set_start_method(method, force=True)
+                stats = SCLCheck.enable_stats()
+                Testing.startTest()
+                SCLBatch.run(paths, 2, out=open(os.devnull, 'w'))
+                assert len(stats.slowest(10)) == len(paths)
+                assert stats.methods()['check_spec']['calls'] == len(paths)
+                SCLCheck.disable_stats()
+        finally:
+            if methods[0]:
+                multiprocessing.set_start_method(default, force=True)
+
+class TestSCLIndex(Tools):
+    '''Tests of collection-wide dependency checks'''
+    def test_transitive_runtime(self):
+        '''Packages reach the runtime through other packages, cycles included'''
+        index = SCLIndex.DependencyIndex()
+        index.add('meta', [('foo-runtime', ['foo-runtime'], ['scl-utils'], True)])
+        index.add('a', [('foo-a', ['foo-a', 'foo-cap'], SCLIndex.capability_names('foo-b >= 1.0'), True)])
+        index.add('b', [('foo-b', ['foo-b'], ['foo-a', 'foo-runtime'], True)])
+        index.add('c', [('foo-c', ['foo-c'], ['foo-cap', 'foo-d'], True)])
+        index.add('d', [('foo-d', ['foo-d'], ['foo-c'], True)])
+        index.add('e', [('foo-e', ['foo-e'], [], False)])
+        index.finish()
+        assert index.reaches_runtime('foo-c') and index.reaches_runtime('foo-d')
+        assert not index.reaches_runtime('foo-e')
+        assert list(index.problems()) == []
+
+    def test_specs_and_binaries(self):
+        '''Spec files use the collection name of the metapackage'''
+        index = SCLIndex.DependencyIndex()
+        for spec in ['spec/nodejs010', 'spec/nodejs-good', 'spec/nodejs-norequire']:
+            index.add(*SCLIndex.entries(os.path.join(os.environ['TESTPATH'], spec + '.spec')))
+        index.finish()
+        assert index.collection_names == ['nodejs010']
+        problems = list(index.problems())
+        # the -docs subpackages require nothing at all
+        assert [name for origin, name in problems] == ['nodejs010-nodejs-docs', 'nodejs010-nodejs', 'nodejs010-nodejs-docs']
+        assert problems[1][0].endswith('nodejs-norequire.spec')
+
+    def test_single_package_spec(self):
+        '''Every package of a SCL ready spec is examined, the last and only one too'''
+        index = SCLIndex.DependencyIndex()
+        meta = ['%global scl foo\n', '%scl_package %scl\n', 'Name: %scl_name\n',
+                '%package runtime\n', '%package build\n']
+        index.add('foo.spec', SCLIndex.spec_entries(SCLCheck.SpecModel(meta)))
+        bar = ['%{?scl:%scl_package bar}\n', 'Name: %{?scl_prefix}bar\n', 'Requires: coreutils\n']
+        index.add('bar.spec', SCLIndex.spec_entries(SCLCheck.SpecModel(bar)))
+        index.finish()
+        assert not index.reaches_runtime('foo-bar')
+        assert list(index.problems()) == [('bar.spec', 'foo-bar')]
+
+    def test_nonscl_provides(self):
+        '''Provides and Requires used only without SCL are not in the index'''
+        spec = ['%{?scl:%scl_package bar}\n', 'Name: %{?scl_prefix}bar\n', 'Provides: %{?scl_prefix}baz\n',
+                '%{!?scl:Provides: bar-compat}\n', '%{!?scl:Requires: coreutils}\n']
+        assert SCLIndex.spec_entries(SCLCheck.SpecModel(spec)) == [('@SCL@-bar', ['@SCL@-bar', '@SCL@-baz'], [], True)]
+
+    def test_batch_cross(self):
+        '''Binary RPMs not requiring anything don't reach the runtime'''
+        Testing.startTest()
+        SCLBatch.run([os.path.join(os.environ['TESTPATH'], 'binary')], 2, out=open(os.devnull, 'w'), cross=True)
+        out = [line for line in Testing.getOutput() if 'doesnt-reach-scl-runtime' in line]
+        assert len(out) == 2
+        assert 'nodejs010-nodejs-oauth-sign' in out[0]
+
+class TestSCLSink(Tools):
+    '''Tests of the machine readable output'''
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        SCLCheck.disable_sink()
+        shutil.rmtree(self.tmpdir)
+
+    def test_locations(self):
+        '''Diagnostics of specs point to the subpackage, line and bytes at fault'''
+        spec = os.path.join(os.environ['TESTPATH'], 'spec/nodejs010-badfiles.spec')
+        pkg = Testing.getTestedSpecPackage('spec/nodejs010-badfiles')
+        with SCLCheck.Diagnostics(pkg) as diags:
+            SCLCheck.check.check_spec(pkg, spec)
+        assert [l.subpackage for l in diags.locations] == ['', 'runtime', 'build']
+        with open(spec, 'rb') as f:
+            data = f.read()
+        for location in diags.locations:
+            assert data[location.start:location.end] == data.split(b'\n')[location.line - 1]
+        assert data[diags.locations[1].start:diags.locations[1].end] == b'%files runtime'
+
+    def test_formats(self):
+        '''Both formats hold the same records, text output stays the same'''
+        expected = self._spec_test_output('spec/nodejs010-badfiles')
+        records = []
+        for name in ['out.jsonl', 'out.bin']:
+            path = os.path.join(self.tmpdir, name)
+            SCLCheck.enable_sink(path)
+            assert self._spec_test_output('spec/nodejs010-badfiles') == expected
+            SCLBatch.run([os.path.join(os.environ['TESTPATH'], 'binary')], 2, out=open(os.devnull, 'w'))
+            SCLCheck.disable_sink()
+            records.append(list(SCLSink.read(path)))
+        assert records[0] == records[1]
+        assert [r['check'] for r in records[0][:3]] == [e.split(': ')[-1].split()[0] for e in expected]
+        assert records[0][1]['subpackage'] == 'runtime' and records[0][1]['line'] == 94
+        binary = [r for r in records[0] if r['check'] == 'file-outside-of-scl-tree']
+        assert binary and binary[0]['line'] is None and binary[0]['details']
+
+    def test_byte_strings(self):
+        '''Byte strings, such as file names from RPM headers, are written decoded, all details come back'''
+        details = [[u'/usr/share/caf\xe9'], [], [''], ['a\x1fb', '', 'a\x1fb']]
+        for name in ['out.jsonl', 'out.bin']:
+            path = os.path.join(self.tmpdir, name)
+            sink = SCLSink.DiagnosticSink(path)
+            sink.add('foo', 'E', 'file-outside-of-scl-tree', [b'/usr/share/caf\xc3\xa9'])
+            for d in details[1:]:
+                sink.add('foo', 'W', 'some-check', d)
+            sink.close()
+            assert [r['details'] for r in SCLSink.read(path)] == details
+
+class ThrottledReader(object):
+    '''SCLAsync.read() as if the packages were on slow storage, counts the reads'''
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.started = self.active = self.most = 0
+
+    def __call__(self, path):
+        with self.lock:
+            self.started += 1
+            self.active += 1
+            self.most = max(self.most, self.active)
+        try:
+            time.sleep(self.latency)
+            return SCLAsync.read(path)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+@pytest.mark.skipif(sys.version_info < (3, 6), reason='SCLAsync needs Python 3.6')
+class TestSCLAsync(Tools):
+    '''Tests of the pipeline reading packages while others are checked'''
+    specs = TestSCLBatch.specs * 5
+
+    def test_keeps_order(self):
+        '''Pipeline output equals serial output in input order, unreadable packages are counted'''
+        expected = []
+        for spec in self.specs:
+            expected.extend(self._spec_test_output(spec))
+        paths = [os.path.join(os.environ['TESTPATH'], spec + '.spec') for spec in self.specs]
+        Testing.startTest()
+        assert SCLAsync.run(paths + ['missing.spec'], 4, 2, 6, out=open(os.devnull, 'w')) == 4 * 5 + 1
+        assert Testing.getOutput() == expected
+
+    def test_spec_read_ahead(self):
+        '''Specs bigger than spec_prefetch_size are streamed, lines cut by it are put back together'''
+        path = os.path.join(os.environ['TESTPATH'], 'spec/nodejs-good.spec')
+        size = SCLAsync.spec_prefetch_size
+        try:
+            SCLAsync.spec_prefetch_size = 100
+            lines = SCLAsync.read(path).specs[0][1]
+            assert list(lines) == list(SCLCheck.read_spec_lines(path, raw=True))
+        finally:
+            SCLAsync.spec_prefetch_size = size
+
+    def test_throttled_reads(self):
+        '''Slow reads overlap, but never get more than prefetch packages ahead of a slow consumer'''
+        paths = [os.path.join(os.environ['TESTPATH'], spec + '.spec') for spec in self.specs]
+        reader = ThrottledReader(0.01)
+        ahead = []
+        res = []
+        # driven by hand, so this file stays valid Python 2
+        items = SCLAsync.pipeline(paths, readers=4, checkers=2, prefetch=6, read=reader)
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                try:
+                    res.append(loop.run_until_complete(items.__anext__()))
+                except StopAsyncIteration:
+                    break
+                ahead.append(reader.started - len(res))
+                time.sleep(0.005)
+        finally:
+            loop.close()
+        assert [r[0] for r in res] == paths
+        assert all(isinstance(r[1], SCLCheck.Diagnostics) for r in res)
+        assert sum(r[1].count('E') for r in res) == 4 * 5
+        assert 1 < reader.most <= 4
+        assert max(ahead) <= 6